@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Backfills the full history of a Gmail label by splitting it into date-range
+shards (Gmail `after:`/`before:` queries) that are synced in parallel worker
+processes. Each shard's progress is checkpointed in the `backfill_shards`
+table, so an interrupted backfill resumes with the shards that are not done.
+"""
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+from gmail_client import open_account_client, run_sync
+from utils.config import Config
+from utils.storage import Shard, open_storage
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger("Backfill")
+
+
+def plan_shards(start: date, end: date, shard_days: int) -> List[Shard]:
+    """
+    Splits [start, end) into consecutive date ranges of `shard_days` days.
+    """
+    shards = []
+    shard_start = start
+    while shard_start < end:
+        shard_end = min(shard_start + timedelta(days=shard_days), end)
+        shards.append((shard_start, shard_end))
+        shard_start = shard_end
+    return shards
+
+
+def _find_account(cfg: Config, folder: str) -> Dict:
+    """
+    Returns the configured account that owns `folder`.
+    """
+    for account in cfg.get_accounts():
+        if folder in cfg.get_folders(account=account["name"]):
+            return account
+    raise IndexError(f"Folder name '{folder}' was not found in config")
+
+
+def _sync_shard(folder: str, shard: Shard) -> int:
+    """
+    Worker entry point: syncs the messages of `folder` within one shard.
+    """
+    shard_start, shard_end = shard
+    cfg = Config(config_path="config.json")
+
+    # Each worker process keeps its own API cache file to avoid clobbering.
+    # Listing, fetch and write errors are raised so the shard is marked failed
+    # rather than checkpointed with missing messages
+    client = open_account_client(
+        cfg,
+        _find_account(cfg, folder),
+        cache_path=f"cache_backfill_{os.getpid()}.json",
+        strict=True,
+    )
+    query = f"after:{shard_start:%Y/%m/%d} before:{shard_end:%Y/%m/%d}"
+    logger.info(f'Syncing "{folder}" shard {query}...')
+
+    storage = open_storage(cfg.get_db_details())
+    try:
+        return run_sync(
+            client,
+            cfg,
+            storage,
+            [folder],
+            query=query,
+            respect_watermark=False,
+            strict=True,
+        )
+    finally:
+        storage.close()
+        client.close()
+
+
+def backfill(
+    folder: str,
+    start: date,
+    end: date,
+    shard_days: int = 30,
+    workers: int = 4,
+):
+    cfg = Config(config_path="config.json")
+
+    # Authenticate once up front so workers start with a fresh token
+    open_account_client(cfg, _find_account(cfg, folder))
+
+    storage = open_storage(cfg.get_db_details())
+    try:
+        # Create the folder row before the workers race to insert it
+        storage.sync_folders([folder])
+
+        shards = plan_shards(start, end, shard_days)
+        storage.record_backfill_shards(folder, shards)
+        done = storage.get_completed_backfill_shards(folder)
+        pending = [shard for shard in shards if shard not in done]
+        logger.info(
+            f'Backfilling "{folder}": {len(pending)}/{len(shards)} shards pending.'
+        )
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(_sync_shard, folder, shard): shard for shard in pending
+            }
+            for future in as_completed(futures):
+                shard = futures[future]
+                try:
+                    count = future.result()
+                except Exception as e:
+                    logger.error(f"Shard {shard[0]} - {shard[1]} failed: {e}")
+                    storage.mark_backfill_shard(folder, shard, "failed")
+                    continue
+
+                storage.mark_backfill_shard(folder, shard, "done", count)
+                logger.info(
+                    f"Shard {shard[0]} - {shard[1]} done ({count} transactions)."
+                )
+    finally:
+        storage.close()
+
+
+def _parse_date(value: str) -> date:
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Backfill a Gmail label's history in resumable date shards."
+    )
+    parser.add_argument("folder", help="Gmail label/folder to backfill.")
+    parser.add_argument(
+        "--start", type=_parse_date, required=True, help="First day (YYYY-MM-DD)."
+    )
+    parser.add_argument(
+        "--end",
+        type=_parse_date,
+        default=date.today() + timedelta(days=1),
+        help="Day after the last day to include (YYYY-MM-DD, default: tomorrow).",
+    )
+    parser.add_argument(
+        "--shard-days", type=int, default=30, help="Days per shard (default: 30)."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Worker processes (default: 4)."
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        backfill(
+            args.folder,
+            args.start,
+            args.end,
+            shard_days=args.shard_days,
+            workers=args.workers,
+        )
+    except Exception as e:
+        logger.error(f"Backfill failed: {e}", exc_info=True)
+        sys.exit(1)
@@ -12,5 +12,34 @@ CREATE TABLE IF NOT EXISTS messages (
   transaction_date date NOT NULL,
   transaction_vendor varchar(40) NOT NULL,
   transaction_amount numeric(10,2) NOT NULL,
-  loaded_at timestamp NOT NULL DEFAULT NOW()
+  loaded_at timestamp NOT NULL DEFAULT NOW(),
+  category text
 );
+
+CREATE INDEX IF NOT EXISTS messages_folder_id_idx ON messages (folder_id);
+
+CREATE TABLE IF NOT EXISTS backfill_shards (
+  folder_name text NOT NULL,
+  shard_start date NOT NULL,
+  shard_end date NOT NULL,
+  status text NOT NULL DEFAULT 'pending',
+  message_count integer,
+  updated_at timestamp NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (folder_name, shard_start, shard_end)
+);
+
+CREATE TABLE IF NOT EXISTS spend_summary (
+  folder_id smallint NOT NULL REFERENCES folders (id),
+  month date NOT NULL,
+  transaction_vendor varchar(40) NOT NULL,
+  transaction_count integer NOT NULL,
+  total_amount numeric(12,2) NOT NULL,
+  PRIMARY KEY (folder_id, month, transaction_vendor)
+);
+
+CREATE INDEX IF NOT EXISTS messages_date_id_idx
+  ON messages (transaction_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS messages_folder_date_id_idx
+  ON messages (folder_id, transaction_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS messages_vendor_prefix_idx
+  ON messages (transaction_vendor varchar_pattern_ops);
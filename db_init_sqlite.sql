@@ -0,0 +1,45 @@
+CREATE TABLE IF NOT EXISTS folders (
+  id integer PRIMARY KEY AUTOINCREMENT,
+  email_server text NOT NULL,
+  folder_name text NOT NULL,
+  last_trans_date text
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+  id text PRIMARY KEY,
+  folder_id integer NOT NULL REFERENCES folders (id),
+  content text,
+  transaction_date text NOT NULL,
+  transaction_vendor text NOT NULL,
+  transaction_amount real NOT NULL,
+  loaded_at text NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  category text
+);
+
+CREATE INDEX IF NOT EXISTS messages_folder_id_idx ON messages (folder_id);
+
+CREATE TABLE IF NOT EXISTS backfill_shards (
+  folder_name text NOT NULL,
+  shard_start text NOT NULL,
+  shard_end text NOT NULL,
+  status text NOT NULL DEFAULT 'pending',
+  message_count integer,
+  updated_at text NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (folder_name, shard_start, shard_end)
+);
+
+CREATE TABLE IF NOT EXISTS spend_summary (
+  folder_id integer NOT NULL REFERENCES folders (id),
+  month text NOT NULL,
+  transaction_vendor text NOT NULL,
+  transaction_count integer NOT NULL,
+  total_amount real NOT NULL,
+  PRIMARY KEY (folder_id, month, transaction_vendor)
+);
+
+CREATE INDEX IF NOT EXISTS messages_date_id_idx
+  ON messages (transaction_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS messages_folder_date_id_idx
+  ON messages (folder_id, transaction_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS messages_vendor_prefix_idx
+  ON messages (transaction_vendor);
@@ -4,7 +4,7 @@ import sys
 from pathlib import Path
 
 from utils.config import Config
-from utils.db import DatabaseConnector
+from utils.storage import open_storage
 
 # Configure logging
 logging.basicConfig(
@@ -32,20 +32,18 @@ def export_transactions():
 
         # Connect to database
         logger.info("Connecting to database...")
-        db = DatabaseConnector(**db_details)
+        storage = open_storage(db_details)
 
         # Ensure export directory exists
         if not EXPORT_PATH.parent.exists():
             logger.info(f"Creating directory: {EXPORT_PATH.parent}")
             EXPORT_PATH.parent.mkdir(parents=True, exist_ok=True)
 
-        # Perform the export using COPY TO STDOUT
+        # Perform the export (COPY TO STDOUT on Postgres)
         logger.info(f"Exporting messages to {EXPORT_PATH}...")
 
-        with open(EXPORT_PATH, "w", encoding="utf-8") as f:
-            with db.conn.cursor() as cursor:
-                copy_sql = "COPY messages TO STDOUT WITH CSV HEADER DELIMITER ','"
-                cursor.copy_expert(copy_sql, f)
+        with open(EXPORT_PATH, "w", encoding="utf-8", newline="") as f:
+            storage.export_messages_csv(f)
 
         logger.info("Export completed successfully.")
 
@@ -53,8 +51,8 @@ def export_transactions():
         logger.error(f"Export failed: {e}", exc_info=True)
         sys.exit(1)
     finally:
-        if "db" in locals() and hasattr(db, "conn"):
-            db.conn.close()
+        if "storage" in locals():
+            storage.close()
 
 
 if __name__ == "__main__":
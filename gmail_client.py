@@ -1,32 +1,52 @@
 from __future__ import print_function
 
-import base64
 import binascii
 import logging
+import multiprocessing
 import os.path
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date as dt_date
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import BatchHttpRequest
 
 from utils.cache import Cache
+from utils.categorize import VendorCategorizer, categorize_transactions
 from utils.config import Config
-from utils.db import DatabaseConnector
-from utils.logging_utils import ListHandler
+from utils.logging_utils import RingBufferHandler
+from utils.mime import decode_part, decode_raw_message, find_body_part
 from utils.parser import (
     apply_regex,
     clean_html,
+    extract_marker_fields,
     find_matches_from_pattern,
+    pattern_fingerprint,
 )
+from utils.storage import Storage, open_storage
+from utils.transactions import Transaction, TransactionBatch
 
 # Set up a module-level logger
 logger = logging.getLogger(__name__)
 
+# API cache key of the last mailbox history ID ingested in push mode
+HISTORY_ID_KEY = "last_history_id"
+# API cache key of the mailbox's label name -> ID map, and its lifetime
+LABEL_MAP_KEY = "label_map"
+LABEL_MAP_TTL = 60 * 60
+
+
+class UnknownAccountError(ValueError):
+    """A push notification names a mailbox that no configured account owns."""
+
 
 class GmailClient:
     def __init__(
@@ -34,13 +54,30 @@ class GmailClient:
         token_path: str = "token.json",
         token_dict: Optional[Dict[str, Any]] = None,
         creds_dict: Optional[Dict[str, Any]] = None,
+        cache_path: str = "cache.json",
+        message_format: str = "full",
+        creds_path: str = "credentials.json",
+        label_ttl: float = LABEL_MAP_TTL,
+        strict: bool = False,
     ):
         self.scopes = ["https://www.googleapis.com/auth/gmail.readonly"]
-        self.creds = self._init_creds(token_path, token_dict, creds_dict)
+        # Raise on label, listing and fetch errors instead of logging them and
+        # carrying on with partial results (for runs that must not checkpoint
+        # incomplete work, e.g. backfill shards)
+        self.strict = strict
+        # Gmail transfer format for message bodies: "full" (parsed JSON parts)
+        # or "raw" (the base64url RFC 822 message)
+        self.message_format = message_format
+        self.creds = self._init_creds(token_path, token_dict, creds_dict, creds_path)
         self.service = self._open_service()
 
         # Create a cache of previous API calls to avoid unnecessary calls
-        self.api_calls_cache = Cache()
+        self.api_calls_cache = Cache(path=cache_path)
+
+        # Seconds before the cached label map is refetched in the background
+        self.label_ttl = label_ttl
+        self.label_map_fetched = False
+        self.label_refresh: Optional[threading.Thread] = None
 
         # Memo to save the corresponding label id for each message id
         self.label_id_to_folder_name_memo: Dict[str, str] = {}
@@ -51,6 +88,7 @@ class GmailClient:
         token_path: str,
         token_dict: Optional[Dict[str, Any]],
         creds_dict: Optional[Dict[str, Any]],
+        creds_path: str = "credentials.json",
     ) -> Optional[Credentials]:
         """Initializes the Gmail client credentials."""
         creds = None
@@ -77,7 +115,7 @@ class GmailClient:
                     flow = InstalledAppFlow.from_client_config(creds_dict, self.scopes)
                 else:
                     flow = InstalledAppFlow.from_client_secrets_file(
-                        "credentials.json", self.scopes
+                        creds_path, self.scopes
                     )
                 creds = flow.run_local_server(port=0)
 
@@ -91,87 +129,191 @@ class GmailClient:
         """Opens the Gmail service."""
         return build("gmail", "v1", credentials=self.creds)
 
-    def get_label_id(self, label_name: str) -> Optional[str]:
+    def _fetch_label_map(self, service) -> Dict[str, str]:
         """
-        Returns the label ID for the given label name.
+        Fetches every label of the mailbox in one labels.list call.
         """
-        cache_key = f"get_label_id_{label_name}"
-        cached_id = self.api_calls_cache.get(cache_key)
-        if cached_id is not None:
-            logger.info(f'Found cached label ID for "{label_name}": "{cached_id}"')
-            self.label_id_to_folder_name_memo[cached_id] = label_name
-            return cached_id
+        res = service.users().labels().list(userId="me").execute()
+        return {label["name"]: label["id"] for label in res.get("labels", [])}
 
-        logger.info(f'Label "{label_name}" not found in cache. Calling Gmail API...')
+    def _store_label_map(self, labels: Dict[str, str]) -> Dict[str, str]:
+        self.api_calls_cache.set(
+            LABEL_MAP_KEY, {"labels": labels, "fetched_at": time.time()}
+        )
+        self.label_map_fetched = True
+        return labels
 
+    def _refresh_label_map(self):
         try:
-            req = self.service.users().labels().list(userId="me")
-            res = req.execute()
+            # The service object is not thread-safe, so use a separate one
+            self._store_label_map(self._fetch_label_map(self._open_service()))
+            logger.info("Refreshed the cached label map.")
         except Exception as e:
-            logger.error(f"Error fetching labels: {e}")
-            return None
+            logger.error(f"Error refreshing labels: {e}")
 
-        labels = res.get("labels", [])
-        if not labels:
-            logger.warning("No labels found.")
-            return None
-
-        for label in labels:
-            if label["name"] == label_name:
-                self.api_calls_cache.set(cache_key, label["id"])
-                self.label_id_to_folder_name_memo[label["id"]] = label_name
-                return label["id"]
-
-        logger.warning(f'Label "{label_name}" not found.')
-        return None
+    def close(self):
+        """
+        Waits for a background label map refresh to finish writing the cache.
+        Call once the client's work is done.
+        """
+        if self.label_refresh:
+            self.label_refresh.join()
+            self.label_refresh = None
 
-    def get_message_ids(self, label_ids: List[str]) -> List[str]:
+    def get_label_map(self, refresh: bool = False) -> Dict[str, str]:
         """
-        Returns a list of message IDs for the given label IDs.
+        Returns the label name -> ID map of the mailbox, cached for
+        `label_ttl` seconds. An expired map is still returned while a
+        background thread refetches it.
         """
-        all_message_ids = []
-        for label_id in label_ids:
-            req = (
-                self.service.users()
-                .messages()
-                .list(
-                    userId="me",
-                    labelIds=[label_id],
-                    includeSpamTrash=False,
-                )
+        entry = self.api_calls_cache.get(LABEL_MAP_KEY)
+        if refresh or entry is None:
+            logger.info("Fetching labels from Gmail API...")
+            return self._store_label_map(self._fetch_label_map(self.service))
+
+        expired = time.time() - entry["fetched_at"] > self.label_ttl
+        if expired and not (self.label_refresh and self.label_refresh.is_alive()):
+            self.label_refresh = threading.Thread(
+                target=self._refresh_label_map, daemon=True
             )
+            self.label_refresh.start()
+        return entry["labels"]
 
-            while req:
-                try:
-                    res = req.execute()
-                except Exception as e:
-                    logger.error(
-                        f"Error fetching message IDs for label {label_id}: {e}"
-                    )
-                    break
-
-                message_ids = res.get("messages", [])
-                message_ids = [message["id"] for message in message_ids]
+    def get_label_ids(
+        self, label_names: List[str], refresh: bool = False
+    ) -> List[str]:
+        """
+        Returns the label IDs of the given label names, skipping unknown ones.
+        Names missing from a cached map trigger one refetch, as the labels
+        may have been created or renamed since.
+        """
+        try:
+            labels = self.get_label_map(refresh=refresh)
+            if not self.label_map_fetched and any(
+                name not in labels for name in label_names
+            ):
+                labels = self.get_label_map(refresh=True)
+        except Exception as e:
+            if self.strict:
+                raise
+            logger.error(f"Error fetching labels: {e}")
+            return []
 
-                for message_id in message_ids:
-                    self.message_id_to_label_id_memo[message_id] = label_id
+        label_ids = []
+        for label_name in label_names:
+            label_id = labels.get(label_name)
+            if label_id is None:
+                if self.strict:
+                    raise ValueError(f'Label "{label_name}" not found')
+                logger.warning(f'Label "{label_name}" not found.')
+                continue
+            self.label_id_to_folder_name_memo[label_id] = label_name
+            label_ids.append(label_id)
+        return label_ids
 
-                all_message_ids.extend(message_ids)
+    def get_label_id(self, label_name: str) -> Optional[str]:
+        """
+        Returns the label ID for the given label name.
+        """
+        label_ids = self.get_label_ids([label_name])
+        return label_ids[0] if label_ids else None
 
-                next_page_token = res.get("nextPageToken")
-                if not next_page_token:
-                    break
+    def _refetch_stale_label(self, label_id: str) -> Optional[str]:
+        """
+        Returns the current ID of the label that `label_id` was resolved from,
+        after refetching the label map. None if the label is gone.
+        """
+        label_name = self.label_id_to_folder_name_memo.pop(label_id, None)
+        if label_name is None:
+            return None
+        logger.warning(
+            f'Label ID "{label_id}" of "{label_name}" no longer exists. '
+            "Refetching labels..."
+        )
+        label_ids = self.get_label_ids([label_name], refresh=True)
+        if not label_ids or label_ids[0] == label_id:
+            return None
+        return label_ids[0]
 
-                req = (
+    def _list_message_ids(
+        self, label_id: str, query: Optional[str] = None
+    ) -> List[str]:
+        """
+        Lists the message IDs of one label, page by page. Raises HttpError if
+        the first page is rejected as an unknown label (400/404).
+        """
+        message_ids = []
+        page_token = None
+        while True:
+            try:
+                res = (
                     self.service.users()
                     .messages()
                     .list(
                         userId="me",
                         labelIds=[label_id],
-                        pageToken=next_page_token,
+                        q=query,
+                        pageToken=page_token,
                         includeSpamTrash=False,
                     )
+                    .execute()
                 )
+            except HttpError as e:
+                if self.strict or (
+                    page_token is None and e.resp.status in (400, 404)
+                ):
+                    raise
+                logger.error(f"Error fetching message IDs for label {label_id}: {e}")
+                break
+            except Exception as e:
+                if self.strict:
+                    raise
+                logger.error(f"Error fetching message IDs for label {label_id}: {e}")
+                break
+
+            message_ids.extend(message["id"] for message in res.get("messages", []))
+
+            page_token = res.get("nextPageToken")
+            if not page_token:
+                break
+
+        return message_ids
+
+    def get_message_ids(
+        self, label_ids: List[str], query: Optional[str] = None
+    ) -> List[str]:
+        """
+        Returns a list of message IDs for the given label IDs, optionally
+        narrowed down with a Gmail search query (e.g. "after:2024/01/01").
+        A label ID that no longer exists is re-resolved by name and retried.
+        """
+        all_message_ids = []
+        for label_id in label_ids:
+            try:
+                message_ids = self._list_message_ids(label_id, query)
+            except HttpError as e:
+                if e.resp.status not in (400, 404):
+                    raise
+                label_id = self._refetch_stale_label(label_id)
+                if label_id is None:
+                    if self.strict:
+                        raise
+                    logger.error(f"Error fetching message IDs: {e}")
+                    continue
+                try:
+                    message_ids = self._list_message_ids(label_id, query)
+                except HttpError as e:
+                    if self.strict:
+                        raise
+                    logger.error(
+                        f"Error fetching message IDs for label {label_id}: {e}"
+                    )
+                    continue
+
+            for message_id in message_ids:
+                self.message_id_to_label_id_memo[message_id] = label_id
+
+            all_message_ids.extend(message_ids)
 
         return all_message_ids
 
@@ -186,7 +328,7 @@ class GmailClient:
                 response = (
                     self.service.users()
                     .messages()
-                    .get(userId="me", id=message_id, format="full")
+                    .get(userId="me", id=message_id, format=self.message_format)
                     .execute()
                 )
                 return response
@@ -199,13 +341,20 @@ class GmailClient:
                         f"Retrying in {wait_time}s (attempt {attempt + 1}/{max_retries})"
                     )
                     time.sleep(wait_time)
+                elif isinstance(e, HttpError) and e.resp.status == 404:
+                    # Deleted since it was listed; retrying cannot bring it back
+                    logger.warning(f"Message {message_id} no longer exists.")
+                    return None
                 else:
+                    if self.strict:
+                        raise
                     logger.error(f"Error fetching message {message_id}: {e}")
                     return None
 
-        logger.error(
-            f"Failed to fetch message {message_id} after {max_retries} retries"
-        )
+        error = f"Failed to fetch message {message_id} after {max_retries} retries"
+        if self.strict:
+            raise RuntimeError(error)
+        logger.error(error)
         return None
 
     def get_messages_batch(self, message_ids: List[str]) -> Dict[str, Dict]:
@@ -246,65 +395,184 @@ class GmailClient:
 
         return results
 
+    def watch(self, label_ids: List[str], topic_name: str) -> Dict[str, Any]:
+        """
+        Registers (or renews) push notifications for changes to the given
+        labels on a Cloud Pub/Sub topic. Gmail drops a watch after 7 days, so
+        this has to be called again at least weekly.
+        """
+        body = {
+            "topicName": topic_name,
+            "labelIds": label_ids,
+            "labelFilterBehavior": "include",
+        }
+        res = self.service.users().watch(userId="me", body=body).execute()
+        logger.info(
+            f"Watching {len(label_ids)} labels on {topic_name} "
+            f"(history ID {res['historyId']}, expires {res['expiration']})."
+        )
+
+        # Keep an existing starting point so renewing never skips history
+        if self.api_calls_cache.get(HISTORY_ID_KEY) is None:
+            self.api_calls_cache.set(HISTORY_ID_KEY, res["historyId"])
+        return res
+
+    def get_history_id(self) -> str:
+        """
+        Returns the mailbox's current history ID.
+        """
+        return self.service.users().getProfile(userId="me").execute()["historyId"]
+
+    def get_history_message_ids(
+        self, start_history_id: str, label_ids: List[str]
+    ) -> Tuple[List[str], Optional[str]]:
+        """
+        Returns the IDs of the messages added to any of the given labels since
+        `start_history_id`, along with the history ID Gmail reports the
+        listing is current as of. Raises googleapiclient.errors.HttpError
+        (404) when Gmail no longer keeps history that far back.
+        """
+        # One unfiltered listing filtered here: per-label listings each report
+        # their own (later) history ID, and resuming from the latest of them
+        # would skip changes the earlier listings did not cover
+        watched = set(label_ids)
+        seen: Set[str] = set()
+        message_ids = []
+        latest_history_id = None
+        page_token = None
+        while True:
+            res = (
+                self.service.users()
+                .history()
+                .list(
+                    userId="me",
+                    startHistoryId=start_history_id,
+                    historyTypes=["messageAdded", "labelAdded"],
+                    pageToken=page_token,
+                )
+                .execute()
+            )
+
+            for record in res.get("history", []):
+                added = [
+                    (change["message"], change["message"].get("labelIds", []))
+                    for change in record.get("messagesAdded", [])
+                ] + [
+                    (change["message"], change.get("labelIds", []))
+                    for change in record.get("labelsAdded", [])
+                ]
+                for message, added_label_ids in added:
+                    label_id = next(
+                        (lid for lid in added_label_ids if lid in watched), None
+                    )
+                    if label_id and message["id"] not in seen:
+                        seen.add(message["id"])
+                        message_ids.append(message["id"])
+                        self.message_id_to_label_id_memo[message["id"]] = label_id
+
+            latest_history_id = res.get("historyId", latest_history_id)
+            page_token = res.get("nextPageToken")
+            if not page_token:
+                break
+
+        return message_ids, latest_history_id
+
 
 def decode_message_content(message_id: str, message_content: Dict) -> Optional[str]:
-    """Extracts and decodes the HTML body from a message dictionary."""
-    raw_message_content = None
-    payload = message_content.get("payload", {})
-    mime_type = payload.get("mimeType")
-
-    if mime_type == "text/html":
-        raw_message_content = payload.get("body", {}).get("data")
-    elif mime_type == "multipart/alternative":
-        for part in payload.get("parts", []):
-            if part.get("mimeType") == "text/html":
-                raw_message_content = part.get("body", {}).get("data")
-                if raw_message_content:
-                    break
-
-    if not raw_message_content:
+    """
+    Extracts and decodes the HTML body from a message dictionary. Handles both
+    `format="full"` payloads (with arbitrarily nested multipart parts) and
+    `format="raw"` messages.
+    """
+    try:
+        if "raw" in message_content:
+            html = decode_raw_message(message_content["raw"])
+        else:
+            part = find_body_part(message_content.get("payload", {}), "text/html")
+            html = decode_part(part) if part else None
+    except (binascii.Error, UnicodeDecodeError, LookupError) as err:
+        logger.error(f'Failed to decode message "{message_id}" : {err}')
+        return None
+
+    if not html:
         logger.debug(f'Message "{message_id}" does not expose an HTML body; skipping.')
         return None
 
+    return html
+
+
+def extract_transaction_fields(
+    ct_cleaned: str, match_pattern: Dict[str, Any]
+) -> Tuple[Any, Any, Any]:
+    """
+    Extracts the (date, amount, vendor) fields from cleaned email text using the
+    folder's match pattern.
+    """
+    use_regex = match_pattern["use_regex"]
+
+    if not use_regex:
+        # Delimiter patterns: all markers are located in one pass over the text
+        fields = extract_marker_fields(match_pattern, ct_cleaned)
+        return fields["date"], fields["amount"], fields["vendor"]
+
+    ct_trimmed = apply_regex(ct_cleaned.replace("\n", " "), match_pattern["regex"])
+
+    amount = find_matches_from_pattern(
+        match_pattern["amount"], ct_trimmed, pat_type="amount", use_regex=use_regex
+    )
+    date = find_matches_from_pattern(
+        match_pattern["date"], ct_trimmed, pat_type="date", use_regex=use_regex
+    )
+    vendor = find_matches_from_pattern(
+        match_pattern["vendor"], ct_trimmed, pat_type="vendor", use_regex=use_regex
+    )
+
+    return date, amount, vendor
+
+
+def _load_memoized_transaction(
+    parse_memo: Optional[Cache], mid: str, pattern_hash: str, emails_path: Path
+) -> Optional[Tuple[str, Any, Any, Any]]:
+    """
+    Returns (content, date, amount, vendor) for a message parsed earlier with
+    the same match pattern, or None if it has to be parsed again.
+    """
+    if parse_memo is None:
+        return None
+
+    memo = parse_memo.get(f"parse_{mid}")
+    if not memo or memo["pattern_hash"] != pattern_hash:
+        return None
+
+    # The cleaned text lives in the emails archive rather than in the memo
     try:
-        raw_bytes = raw_message_content.encode("ascii")
-        padding_needed = (-len(raw_bytes)) % 4
-        raw_bytes += b"=" * padding_needed
-        return base64.urlsafe_b64decode(raw_bytes).decode("utf-8")
-    except (binascii.Error, UnicodeDecodeError) as err:
-        logger.error(f'Failed to decode message "{message_id}" : {err}')
+        with open(emails_path, "r", encoding="utf-8") as f:
+            ct_cleaned = f.read()
+    except IOError:
         return None
 
+    date = dt_date.fromisoformat(memo["date"]) if memo["date"] else None
+    return ct_cleaned, date, memo["amount"], memo["vendor"]
+
 
 def process_transactions(
     client: GmailClient,
     cfg: Config,
     messages: Dict[str, Dict],
-) -> List[Dict[str, Any]]:
+    parse_memo: Optional[Cache] = None,
+) -> TransactionBatch:
     """
     Decodes messages, extracts transaction details, and prepares them for DB insertion.
+    Messages already parsed with the folder's current match pattern are served
+    from `parse_memo` without decoding or re-extracting them.
     """
     transaction_msgs_agg = []
     emails_dir = Path("emails")
     emails_dir.mkdir(parents=True, exist_ok=True)
+    pattern_hashes: Dict[str, str] = {}
+    memo_hits = 0
 
     for mid, content in messages.items():
-        decoded_html = decode_message_content(mid, content)
-        if not decoded_html:
-            continue
-
-        # Save to file (legacy requirement)
-        emails_path = emails_dir / f"message_{mid}.txt"
-        ct_cleaned = clean_html(decoded_html)
-
-        try:
-            with open(emails_path, "w", encoding="utf-8") as f:
-                f.write(ct_cleaned)
-        except IOError as e:
-            logger.error(f"Failed to write email file for {mid}: {e}")
-
-        ct_trimmed = ct_cleaned.replace("\n", " ")
-
         # Identify folder and pattern
         label_id = client.message_id_to_label_id_memo.get(mid)
         if not label_id:
@@ -317,215 +585,565 @@ def process_transactions(
             continue
 
         match_pattern = cfg.get_match_pattern(folder_name)
-        use_regex = match_pattern["use_regex"]
-        regex_pat = match_pattern["regex"] if use_regex else None
-
-        if use_regex:
-            ct_trimmed = apply_regex(ct_trimmed, regex_pat)
+        if folder_name not in pattern_hashes:
+            pattern_hashes[folder_name] = pattern_fingerprint(match_pattern)
+        pattern_hash = pattern_hashes[folder_name]
 
-        amount = find_matches_from_pattern(
-            match_pattern["amount"], ct_trimmed, pat_type="amount", use_regex=use_regex
-        )
-        date = find_matches_from_pattern(
-            match_pattern["date"], ct_trimmed, pat_type="date", use_regex=use_regex
-        )
-        vendor = find_matches_from_pattern(
-            match_pattern["vendor"], ct_trimmed, pat_type="vendor", use_regex=use_regex
+        emails_path = emails_dir / f"message_{mid}.txt"
+        memoized = _load_memoized_transaction(
+            parse_memo, mid, pattern_hash, emails_path
         )
 
+        if memoized:
+            ct_cleaned, date, amount, vendor = memoized
+            memo_hits += 1
+        else:
+            decoded_html = decode_message_content(mid, content)
+            if not decoded_html:
+                continue
+
+            # Save to file (legacy requirement)
+            ct_cleaned = clean_html(decoded_html)
+
+            try:
+                with open(emails_path, "w", encoding="utf-8") as f:
+                    f.write(ct_cleaned)
+            except IOError as e:
+                logger.error(f"Failed to write email file for {mid}: {e}")
+
+            date, amount, vendor = extract_transaction_fields(ct_cleaned, match_pattern)
+
+            if parse_memo is not None:
+                parse_memo.set(
+                    f"parse_{mid}",
+                    {
+                        "pattern_hash": pattern_hash,
+                        "date": date.isoformat() if date else None,
+                        "amount": amount,
+                        "vendor": vendor,
+                    },
+                )
+
         logger.info(f"Extracted - Date: {date}, Amount: {amount}, Vendor: {vendor}")
 
         transaction_msgs_agg.append(
-            {
-                "id": mid,
-                "folder_name": folder_name,
-                "content": ct_cleaned,
-                "transaction_date": date,
-                "transaction_amount": amount,
-                "transaction_vendor": vendor,
-            }
+            Transaction(mid, folder_name, ct_cleaned, date, amount, vendor)
         )
 
-    return transaction_msgs_agg
+    if parse_memo is not None:
+        parse_memo.save()
+        logger.info(f"Reused {memo_hits}/{len(messages)} memoized parse results.")
+
+    return TransactionBatch(transaction_msgs_agg)
+
+
+def load_ingested_message_ids(storage: Storage, folder_names: List[str]) -> Set[str]:
+    """
+    Returns the IDs of messages already stored for the given folders, loaded in
+    a single query so they can be dropped before any fetch or decode work.
+    """
+    if not folder_names:
+        return set()
+
+    try:
+        return storage.get_ingested_message_ids(folder_names)
+    except Exception as e:
+        logger.error(f"Error loading ingested message IDs: {e}")
+        return set()
 
 
 def save_to_database(
-    client: GmailClient,
-    cfg: Config,
-    transactions: List[Dict[str, Any]],
+    client: Optional[GmailClient],
+    storage: Storage,
+    transactions: TransactionBatch,
+    folder_names: Optional[List[str]] = None,
+    upsert: bool = False,
+    respect_watermark: bool = True,
+    strict: bool = False,
 ):
     """
     Inserts folders and messages into the database.
+    With `upsert`, existing rows get their extracted fields overwritten. With
+    `respect_watermark` off, messages older than the folder's last transaction
+    date are written too (used for reprocessing and historical backfills).
+    With `strict`, a failed write is raised instead of logged.
     """
+    # Use the memo from client to get all relevant folders, unless given
+    if folder_names is None:
+        folder_names = list(client.label_id_to_folder_name_memo.values())
+
+    # Ensure folders exist
+    folder_info = storage.sync_folders(folder_names)
+
+    # Keep valid transactions of known folders, newer than the watermarks
+    keep = transactions.in_folders(folder_info) & transactions.valid()
+    if respect_watermark:
+        keep &= transactions.newer_than_watermarks(folder_info)
+    rows = transactions.select(keep).rows(folder_info)
+
+    # Insert transactions in bulk
     try:
-        db = DatabaseConnector(**cfg.get_db_details())
-        cursor = db.conn.cursor()
+        storage.write_messages(rows, upsert=upsert)
+        logger.info(f"Wrote {len(rows)} messages to the database.")
     except Exception as e:
-        logger.error(f"Database connection failed: {e}")
+        if strict:
+            raise
+        logger.error(f"Error inserting {len(rows)} messages: {e}")
+
+    # Update folders with latest transaction date
+    try:
+        storage.refresh_watermarks()
+    except Exception as e:
+        logger.error(f"Error updating folder stats: {e}")
+
+
+def open_account_client(
+    cfg: Config,
+    account: Dict[str, Any],
+    cache_path: Optional[str] = None,
+    strict: bool = False,
+) -> GmailClient:
+    """
+    Opens a Gmail client for one configured account (see Config.get_accounts).
+    A `strict` client raises on API errors instead of skipping what failed.
+    """
+    return GmailClient(
+        token_path=account["token_path"],
+        token_dict=account.get("token"),
+        creds_dict=account.get("credentials"),
+        cache_path=cache_path or account["cache_path"],
+        message_format=cfg.get_message_format(),
+        creds_path=account["credentials_path"],
+        strict=strict,
+    )
+
+
+def collect_transactions(
+    client: GmailClient,
+    cfg: Config,
+    storage: Storage,
+    folders: List[str],
+    query: Optional[str] = None,
+    parse_memo: Optional[Cache] = None,
+) -> TransactionBatch:
+    """
+    Fetches and parses the messages of the given folders that are not stored
+    yet. Nothing is written to the database.
+    """
+    # Get internal folder IDs
+    label_ids = client.get_label_ids(folders)
+
+    # Get message IDs
+    message_ids = client.get_message_ids(label_ids, query=query)
+
+    return collect_messages(client, cfg, storage, message_ids, parse_memo)
+
+
+def collect_messages(
+    client: GmailClient,
+    cfg: Config,
+    storage: Storage,
+    message_ids: List[str],
+    parse_memo: Optional[Cache] = None,
+) -> TransactionBatch:
+    """
+    Fetches and parses the given messages, skipping those that are already
+    stored. Nothing is written to the database.
+    """
+    # Drop messages that are already stored before fetching anything
+    ingested_ids = load_ingested_message_ids(
+        storage, list(client.label_id_to_folder_name_memo.values())
+    )
+    if ingested_ids:
+        total_ids = len(message_ids)
+        message_ids = [mid for mid in message_ids if mid not in ingested_ids]
+        logger.info(
+            f"Skipping {total_ids - len(message_ids)} already-ingested messages."
+        )
+
+    if not message_ids:
+        logger.info("No new messages found.")
+        return TransactionBatch()
+
+    # Get messages (Batch)
+    messages_map = client.get_messages_batch(message_ids)
+
+    # Process transactions
+    return process_transactions(client, cfg, messages_map, parse_memo)
+
+
+def build_categorizer(cfg: Config) -> Optional[VendorCategorizer]:
+    """
+    Returns a vendor categorizer for the config's rules, or None if
+    categorization is not set up.
+    """
+    rules = cfg.get_categories()
+    return VendorCategorizer(rules) if rules else None
+
+
+def store_transactions(
+    cfg: Config,
+    storage: Storage,
+    transactions: TransactionBatch,
+    folder_names: List[str],
+    respect_watermark: bool = True,
+    strict: bool = False,
+    categorizer: Optional[VendorCategorizer] = None,
+):
+    """
+    Runs the post-processing stages over a batch of transactions and writes it
+    to the database in bulk. Runs that store several batches should pass one
+    `categorizer` so its vendor memo carries over between them.
+    """
+    if not transactions:
         return
 
-    # Ensure folders exist
-    folder_name_id_latest_msg_id_memo = {}
+    # Categorize vendors (optional stage)
+    if categorizer is None:
+        categorizer = build_categorizer(cfg)
+    if categorizer:
+        categorize_transactions(transactions, categorizer)
+
+    # Save to DB
+    save_to_database(
+        None,
+        storage,
+        transactions,
+        folder_names=folder_names,
+        respect_watermark=respect_watermark,
+        strict=strict,
+    )
+
+
+def run_sync(
+    client: GmailClient,
+    cfg: Config,
+    storage: Storage,
+    folders: List[str],
+    query: Optional[str] = None,
+    parse_memo: Optional[Cache] = None,
+    respect_watermark: bool = True,
+    strict: bool = False,
+) -> int:
+    """
+    Fetches, parses and stores the new messages of the given folders.
+    Returns the number of transactions handed to the database. With
+    `strict`, a failed database write is raised (pair it with a strict
+    client to also raise on Gmail API errors).
+    """
+    transactions = collect_transactions(
+        client, cfg, storage, folders, query=query, parse_memo=parse_memo
+    )
+    store_transactions(
+        cfg,
+        storage,
+        transactions,
+        list(client.label_id_to_folder_name_memo.values()),
+        respect_watermark=respect_watermark,
+        strict=strict,
+    )
+    return len(transactions)
+
 
-    # Use the memo from client to get all relevant folders
-    for folder_name in client.label_id_to_folder_name_memo.values():
+def ingest_history(
+    client: GmailClient,
+    cfg: Config,
+    storage: Storage,
+    folders: List[str],
+    history_id: str,
+    parse_memo: Optional[Cache] = None,
+) -> int:
+    """
+    Push mode: fetches, parses and stores only the messages added to the given
+    folders since the last ingested mailbox history ID, then advances it to
+    the history ID Gmail reports for that listing. Falls back to a full sync
+    when there is no starting point or Gmail no longer keeps that history.
+    Returns the number of transactions handed to the database. Pass a strict
+    client: any failure is raised and leaves the history ID where it was.
+    """
+    start_history_id = client.api_calls_cache.get(HISTORY_ID_KEY)
+    if start_history_id is not None and int(history_id) <= int(start_history_id):
+        logger.info(f"History ID {history_id} was already ingested.")
+        return 0
+
+    message_ids = None
+    if start_history_id is None:
+        logger.warning("No history ID to start from. Running a full sync...")
+    else:
+        label_ids = client.get_label_ids(folders)
         try:
-            cursor.execute(
-                "SELECT * FROM folders WHERE folder_name = %s", (folder_name,)
+            message_ids, latest_history_id = client.get_history_message_ids(
+                start_history_id, label_ids
             )
-            result = cursor.fetchone()
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            logger.warning(
+                f"History ID {start_history_id} has expired. Running a full sync..."
+            )
+
+    if message_ids is None:
+        # Read before syncing, so changes made during the sync are replayed
+        # by the next notification (stored messages are skipped)
+        latest_history_id = client.get_history_id()
+        count = run_sync(
+            client, cfg, storage, folders, parse_memo=parse_memo, strict=True
+        )
+    else:
+        logger.info(
+            f"History since {start_history_id} added {len(message_ids)} "
+            "messages to the watched folders."
+        )
+        transactions = collect_messages(client, cfg, storage, message_ids, parse_memo)
+        # Deltas hold single messages: the watermark would drop every later
+        # transaction of a day once its first one is stored. The ingested-ID
+        # filter and ON CONFLICT already prevent duplicates
+        store_transactions(
+            cfg,
+            storage,
+            transactions,
+            list(client.label_id_to_folder_name_memo.values()),
+            respect_watermark=False,
+            strict=True,
+        )
+        count = len(transactions)
+
+    # Only reached when everything up to the new history ID is stored: listing,
+    # fetch and write errors are raised so the notification is redelivered
+    if latest_history_id is not None:
+        client.api_calls_cache.set(HISTORY_ID_KEY, str(latest_history_id))
+    return count
+
+
+def _init_account_worker(log_queue):
+    # Forward worker logs to the parent, which owns the run's log handlers
+    root_logger = logging.getLogger()
+    root_logger.handlers = [QueueHandler(log_queue)]
+    root_logger.setLevel(logging.INFO)
+
 
-            if result is None:
-                cursor.execute(
-                    """INSERT INTO folders (email_server, folder_name)
-                    VALUES (%s, %s) RETURNING id""",
-                    ("gmail", folder_name),
+def _collect_account(
+    cfg_items: Dict, account: Dict[str, Any]
+) -> Tuple[List[str], TransactionBatch]:
+    """
+    Worker entry point: fetches and parses the new messages of one account,
+    using the account's own credentials, API cache and parse memo.
+    """
+    cfg = Config(config_path="config.json", config_dict=cfg_items)
+    client = open_account_client(cfg, account)
+    storage = open_storage(cfg.get_db_details())
+    try:
+        parse_memo = Cache(path=account["parse_cache_path"], autosave=False)
+        transactions = collect_transactions(
+            client,
+            cfg,
+            storage,
+            cfg.get_folders(type="gmail", account=account["name"]),
+            parse_memo=parse_memo,
+        )
+    finally:
+        storage.close()
+        client.close()
+
+    return list(client.label_id_to_folder_name_memo.values()), transactions
+
+
+def sync_accounts(cfg: Config, storage: Storage, accounts: List[Dict]) -> int:
+    """
+    Syncs several accounts concurrently, one worker process per account. Each
+    account's transactions are written through the shared bulk path as soon as
+    its worker finishes. Returns the number of transactions handed to the DB.
+    """
+    log_queue = multiprocessing.Queue()
+    listener = QueueListener(
+        log_queue, *logging.getLogger().handlers, respect_handler_level=True
+    )
+    listener.start()
+
+    total = 0
+    categorizer = build_categorizer(cfg)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=len(accounts),
+            initializer=_init_account_worker,
+            initargs=(log_queue,),
+        ) as pool:
+            futures = {
+                pool.submit(_collect_account, cfg.items, account): account["name"]
+                for account in accounts
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    folder_names, transactions = future.result()
+                except Exception as e:
+                    logger.error(f'Sync of account "{name}" failed: {e}')
+                    continue
+
+                store_transactions(
+                    cfg, storage, transactions, folder_names, categorizer=categorizer
                 )
-                folder_id = cursor.fetchone()[0]
-                folder_name_id_latest_msg_id_memo[folder_name] = (folder_id, None)
-            else:
-                folder_id, _, _, last_trans_date = result
-                folder_name_id_latest_msg_id_memo[folder_name] = (
-                    folder_id,
-                    last_trans_date,
+                total += len(transactions)
+                logger.info(
+                    f'Account "{name}" synced ({len(transactions)} transactions).'
                 )
-        except Exception as e:
-            logger.error(f"Error syncing folder '{folder_name}': {e}")
+    finally:
+        listener.stop()
 
-    # Insert transactions
-    for msg in transactions:
-        folder_info = folder_name_id_latest_msg_id_memo.get(msg["folder_name"])
-        if not folder_info:
-            continue
+    return total
 
-        folder_id, last_trans_date = folder_info
 
-        # Skip if older than last transaction
-        if (
-            last_trans_date
-            and msg["transaction_date"]
-            and msg["transaction_date"] <= last_trans_date
-        ):
-            continue
+def _load_config(cfg_dict: Optional[Dict] = None) -> Tuple[Config, List[Dict]]:
+    """
+    Loads the config and its accounts. `cfg_dict` holds the env var configs
+    (see utils.fs.init_env_vars) of server deployments.
+    """
+    cfg = Config(
+        config_path="config.json",
+        config_dict=cfg_dict["APP_CONFIG"] if cfg_dict else None,
+    )
 
-        # Basic validation
-        if not msg["transaction_date"]:
-            # logger.debug(f"Skipping message {msg['id']}: No transaction date")
-            continue
+    accounts = cfg.get_accounts()
+    if cfg_dict and len(accounts) == 1:
+        # Single-mailbox deployments pass credentials through env vars
+        accounts[0].setdefault("token", cfg_dict["GOOGLE_TOKEN"])
+        accounts[0].setdefault("credentials", cfg_dict["GOOGLE_CREDENTIALS"])
 
+    return cfg, accounts
+
+
+def register_watches(cfg_dict: Optional[Dict] = None) -> List[Dict[str, Any]]:
+    """
+    Registers (or renews) Gmail push notifications for the configured folders
+    of every account. Returns each account's watch response.
+    """
+    cfg, accounts = _load_config(cfg_dict)
+    topic_name = cfg.get_push_topic()
+    if not topic_name:
+        raise ValueError('Push mode requires a "push": {"topic": ...} config entry')
+
+    watches = []
+    for account in accounts:
+        client = open_account_client(cfg, account)
         try:
-            cursor.execute(
-                """
-                INSERT INTO messages (
-                    id, folder_id, content, transaction_date, 
-                    transaction_vendor, transaction_amount
-                )
-                VALUES (%s, %s, %s, %s, %s, %s)
-                ON CONFLICT (id) DO NOTHING;
-                """,
-                (
-                    msg["id"],
-                    folder_id,
-                    msg["content"],
-                    msg["transaction_date"],
-                    msg["transaction_vendor"],
-                    msg["transaction_amount"],
-                ),
+            label_ids = client.get_label_ids(
+                cfg.get_folders(type="gmail", account=account["name"])
             )
-        except Exception as e:
-            logger.error(f"Error inserting message {msg['id']}: {e}")
+            res = client.watch(label_ids, topic_name)
+        finally:
+            client.close()
+        watches.append({"account": account["name"], **res})
+    return watches
 
-    # Update folders with latest transaction date
+
+def ingest_push_notification(
+    notification: Dict[str, Any], cfg_dict: Optional[Dict] = None
+) -> int:
+    """
+    Handles one Gmail push notification ({"emailAddress", "historyId"}) by
+    ingesting the history delta of the notified account's folders.
+    Returns the number of transactions handed to the database. Raises
+    UnknownAccountError when no configured account owns the mailbox.
+    """
+    cfg, accounts = _load_config(cfg_dict)
+    email_address = notification["emailAddress"]
+    matches = [a for a in accounts if a.get("email_address") == email_address]
+    if not matches and len(accounts) == 1:
+        matches = accounts
+    if not matches:
+        raise UnknownAccountError(f'No account is configured for "{email_address}"')
+
+    account = matches[0]
+    name = account["name"]
+    logger.info(
+        f'Push notification for account "{name}" '
+        f"(history ID {notification['historyId']})."
+    )
+
+    client = open_account_client(cfg, account, strict=True)
+    storage = open_storage(cfg.get_db_details())
     try:
-        cursor.execute(
-            """
-            UPDATE folders f
-            SET last_trans_date = sub.max_date
-            FROM (
-                SELECT folder_id, MAX(transaction_date) as max_date
-                FROM messages
-                GROUP BY folder_id
-            ) sub
-            WHERE f.id = sub.folder_id;
-            """
+        return ingest_history(
+            client,
+            cfg,
+            storage,
+            cfg.get_folders(type="gmail", account=name),
+            str(notification["historyId"]),
+            parse_memo=Cache(path=account["parse_cache_path"], autosave=False),
         )
-    except Exception as e:
-        logger.error(f"Error updating folder stats: {e}")
-
-    cursor.close()
+    finally:
+        storage.close()
+        client.close()
 
 
-def main(cfg_dict: Optional[Dict] = None) -> List[str]:
+def main(
+    cfg_dict: Optional[Dict] = None,
+    log_path: Optional[str] = None,
+    log_capacity: int = 1000,
+) -> List[str]:
+    """
+    Runs the full pipeline and returns the most recent `log_capacity` log
+    lines. When `log_path` is given, every log line is also streamed to that
+    file as the run progresses.
+    """
     # Configure logging
-    log_capture_list = []
-    handler = ListHandler(log_capture_list)
+    handler = RingBufferHandler(capacity=log_capacity, log_path=log_path)
     formatter = logging.Formatter(
         "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     )
     handler.setFormatter(formatter)
 
-    # Add handler to root logger or module logger
-    # We use module logger here but ensure it propagates or we add to root if needed
-    # For simplicity, let's configure the root logger to output to stdout as well
-    # and our list handler.
+    # Capture everything through the root logger, and also output to stdout
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(handler)
 
-    # Avoid adding duplicate handlers if main is called multiple times in same process
-    if not any(isinstance(h, ListHandler) for h in root_logger.handlers):
-        root_logger.addHandler(handler)
-
-        # Also add a stream handler for console output if not present
-        if not any(isinstance(h, logging.StreamHandler) for h in root_logger.handlers):
-            console_handler = logging.StreamHandler()
-            console_handler.setFormatter(formatter)
-            root_logger.addHandler(console_handler)
+    # Also add a stream handler for console output if not present
+    if not any(isinstance(h, logging.StreamHandler) for h in root_logger.handlers):
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        root_logger.addHandler(console_handler)
 
     try:
         # Load config
-        cfg = Config(
-            config_path="config.json",
-            config_dict=cfg_dict["APP_CONFIG"] if cfg_dict else None,
-        )
-
-        # Initialize client
-        client = GmailClient(
-            token_path="token.json",
-            token_dict=cfg_dict["GOOGLE_TOKEN"] if cfg_dict else None,
-            creds_dict=cfg_dict["GOOGLE_CREDENTIALS"] if cfg_dict else None,
-        )
-
-        # Get internal folder IDs
-        folders = cfg.get_folders(type="gmail")
-        label_ids = []
-        for folder in folders:
-            label_id = client.get_label_id(folder)
-            if label_id:
-                label_ids.append(label_id)
-
-        # Get message IDs
-        message_ids = client.get_message_ids(label_ids)
-
-        if not message_ids:
-            logger.info("No messages found.")
-            return log_capture_list
+        cfg, accounts = _load_config(cfg_dict)
 
-        # Get messages (Batch)
-        messages_map = client.get_messages_batch(message_ids)
-
-        # Process transactions
-        transactions = process_transactions(client, cfg, messages_map)
+        # Open the configured storage backend
+        try:
+            storage = open_storage(cfg.get_db_details())
+        except Exception as e:
+            logger.error(f"Database connection failed: {e}")
+            return handler.lines()
 
-        # Save to DB
-        save_to_database(client, cfg, transactions)
+        # Sync all configured folders
+        try:
+            if len(accounts) == 1:
+                account = accounts[0]
+                client = open_account_client(cfg, account)
+                parse_memo = Cache(path=account["parse_cache_path"], autosave=False)
+                try:
+                    run_sync(
+                        client,
+                        cfg,
+                        storage,
+                        cfg.get_folders(type="gmail", account=account["name"]),
+                        parse_memo=parse_memo,
+                    )
+                finally:
+                    client.close()
+            else:
+                sync_accounts(cfg, storage, accounts)
+        finally:
+            storage.close()
 
     except Exception as e:
         logger.error(f"Critical error in main pipeline: {e}", exc_info=True)
+    finally:
+        # Clean up handler to prevent leaks or duplicate logs in long-running process
+        root_logger.removeHandler(handler)
+        handler.close()
 
-    # Clean up handler to prevent memory leaks or duplicate logs in long-running process
-    root_logger.removeHandler(handler)
-
-    return log_capture_list
+    return handler.lines()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Re-runs transaction extraction over locally stored emails without touching the
+Gmail API, and upserts the corrected fields into the database.
+
+Messages are read from the API cache (`cache.json`) when available, and from
+the cleaned `emails/` archive otherwise.
+"""
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from gmail_client import (
+    LABEL_MAP_KEY,
+    build_categorizer,
+    decode_message_content,
+    extract_transaction_fields,
+    save_to_database,
+)
+from utils.cache import Cache
+from utils.categorize import categorize_transactions
+from utils.config import Config
+from utils.parser import clean_html
+from utils.storage import Storage, open_storage
+from utils.transactions import Transaction, TransactionBatch
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger("ReprocessTransactions")
+
+EMAILS_DIR = Path("emails")
+
+# (message id, folder name, match pattern, archived text path, raw API message)
+WorkItem = Tuple[str, str, Dict[str, Any], Optional[str], Optional[Dict]]
+
+
+def _reextract(item: WorkItem) -> Tuple[str, Optional[Transaction], str]:
+    """
+    Worker entry point: returns (message id, transaction or None, error).
+    """
+    mid, folder_name, match_pattern, emails_path, raw_message = item
+    try:
+        if emails_path:
+            with open(emails_path, "r", encoding="utf-8") as f:
+                ct_cleaned = f.read()
+        else:
+            decoded_html = decode_message_content(mid, raw_message)
+            if not decoded_html:
+                return mid, None, "no HTML body"
+            ct_cleaned = clean_html(decoded_html)
+
+        date, amount, vendor = extract_transaction_fields(ct_cleaned, match_pattern)
+    except Exception as e:
+        return mid, None, str(e)
+
+    return (
+        mid,
+        Transaction(mid, folder_name, ct_cleaned, date, amount, vendor),
+        "",
+    )
+
+
+def collect_work_items(
+    cfg: Config, storage: Storage, folder_names: List[str]
+) -> List[WorkItem]:
+    """
+    Builds the list of messages to re-extract for the given folders.
+    """
+    items: List[WorkItem] = []
+    patterns = {name: cfg.get_match_pattern(name) for name in folder_names}
+
+    # Messages from each account's API cache carry their own label IDs
+    for account in cfg.get_accounts():
+        api_cache = Cache(path=account["cache_path"])
+        label_map = (api_cache.get(LABEL_MAP_KEY) or {}).get("labels", {})
+        label_id_to_folder_name = {}
+        for folder_name in folder_names:
+            label_id = label_map.get(folder_name)
+            if label_id:
+                label_id_to_folder_name[label_id] = folder_name
+
+        for key, message in api_cache.cache.items():
+            if not key.startswith("get_message_"):
+                continue
+            mid = key[len("get_message_") :]
+            for label_id in message.get("labelIds", []):
+                folder_name = label_id_to_folder_name.get(label_id)
+                if folder_name:
+                    items.append(
+                        (mid, folder_name, patterns[folder_name], None, message)
+                    )
+                    break
+
+    # Fall back to the emails archive for stored messages missing from the cache
+    seen_ids = {item[0] for item in items}
+    stored = storage.get_stored_message_folders(folder_names)
+    for mid, folder_name in stored.items():
+        emails_path = EMAILS_DIR / f"message_{mid}.txt"
+        if mid not in seen_ids and emails_path.exists():
+            items.append(
+                (mid, folder_name, patterns[folder_name], str(emails_path), None)
+            )
+
+    return items
+
+
+def reprocess(
+    folder: Optional[str] = None,
+    workers: Optional[int] = None,
+    dry_run: bool = False,
+):
+    cfg = Config(config_path="config.json")
+    folder_names = [folder] if folder else cfg.get_folders(type="gmail")
+
+    storage = open_storage(cfg.get_db_details())
+    try:
+        items = collect_work_items(cfg, storage, folder_names)
+        logger.info(
+            f"Re-extracting {len(items)} messages across "
+            f"{len(folder_names)} folders..."
+        )
+
+        extracted: List[Transaction] = []
+        failures = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(items) // ((workers or os.cpu_count() or 1) * 4))
+            results = pool.map(_reextract, items, chunksize=chunksize)
+            for mid, transaction, error in results:
+                if transaction is None:
+                    failures += 1
+                    logger.warning(f"Could not re-extract message {mid}: {error}")
+                    continue
+                extracted.append(transaction)
+
+        logger.info(f"Re-extracted {len(extracted)} messages ({failures} failed).")
+        transactions = TransactionBatch(extracted)
+
+        categorizer = build_categorizer(cfg)
+        if categorizer:
+            categorize_transactions(transactions, categorizer)
+
+        if dry_run:
+            for transaction in transactions:
+                logger.info(
+                    f"{transaction.id}: Date: {transaction.transaction_date}, "
+                    f"Amount: {transaction.transaction_amount}, "
+                    f"Vendor: {transaction.transaction_vendor}"
+                )
+            return
+
+        save_to_database(
+            None,
+            storage,
+            transactions,
+            folder_names=folder_names,
+            upsert=True,
+            respect_watermark=False,
+        )
+    finally:
+        storage.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay transaction extraction from local emails (no network)."
+    )
+    parser.add_argument("--folder", help="Only reprocess this Gmail label/folder.")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Worker processes (default: CPUs)."
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Log the re-extracted values without writing to the database.",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        reprocess(folder=args.folder, workers=args.workers, dry_run=args.dry_run)
+    except Exception as e:
+        logger.error(f"Reprocessing failed: {e}", exc_info=True)
+        sys.exit(1)
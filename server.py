@@ -1,16 +1,46 @@
+from contextlib import contextmanager
 from datetime import datetime
+import hmac
 import logging
+import os
+import sqlite3
+import threading
 
-from flask import Flask
+from flask import Flask, jsonify, request
+import psycopg2
 
+from gmail_client import (
+    UnknownAccountError,
+    ingest_push_notification,
+    register_watches,
+)
 from gmail_client import main as abg_pipeline
 import utils.fs as fs
+from utils.cache import LRUCache
+from utils.config import Config
+from utils.notify import decode_push_envelope
+from utils.storage import open_storage
 
 logging.basicConfig(
     level=logging.INFO, format="%(levelname)-9s %(asctime)s - [%(name)s] %(message)s"
 )
 logger = logging.getLogger("AutoBudget Server")
 
+# Maximum number of log lines kept in memory and returned from /run
+LOG_CAPACITY = int(os.environ.get("ABG_LOG_CAPACITY", "1000"))
+
+# Responses of /transactions, cleared whenever the pipeline runs in this
+# process. The TTL bounds staleness after runs from other processes (e.g. cron)
+TRANSACTIONS_PAGE_LIMIT = 500
+transactions_cache = LRUCache(maxsize=256, ttl=60)
+
+# Shared secret expected as ?token= on push deliveries (set on the Pub/Sub
+# push subscription's endpoint URL). Push mode is disabled while it is unset
+PUSH_TOKEN = os.environ.get("ABG_PUSH_TOKEN")
+# Pipeline runs and push ingestions go one at a time: they share the API
+# caches, and each /run captures every log record of the process while it runs
+pipeline_lock = threading.Lock()
+
 app = Flask(__name__)
 
 
@@ -27,20 +57,177 @@ def run_gmail_client():
     env_vars = fs.init_env_vars()
 
     logger.info("Executing AutoBudget pipeline...")
-    logs = abg_pipeline(env_vars)
-    logger.info("AutoBudget pipeline successfully executed. Now logging the output artifacts...")
-
-    log_out = ""
-    with open(f"log_{datetime.now().strftime('%m_%d_%Y_%H_%M')}.txt", "w") as f:
-        for line in logs:
-            f.write(f"{line}\n")
-            log_out += f"{line}\n"
+    log_path = f"log_{datetime.now().strftime('%m_%d_%Y_%H_%M')}.txt"
+    with pipeline_lock:
+        logs = abg_pipeline(env_vars, log_path=log_path, log_capacity=LOG_CAPACITY)
+    transactions_cache.clear()
+    logger.info(
+        f"AutoBudget pipeline successfully executed. Full run log written to {log_path}"
+    )
 
+    log_out = "\n".join(logs)
     success_msg = f"AutoBudget Pipeline Run Successful.\n\n{log_out}"
-    logger.info(success_msg)
 
     return success_msg
 
 
+@app.route("/watch")
+def watch_gmail():
+    """
+    Registers (or renews) Gmail push notifications for the configured folders.
+    Gmail expires watches after 7 days, so call this at least daily (cron).
+    """
+    if not PUSH_TOKEN:
+        return jsonify(error="Push mode is disabled: ABG_PUSH_TOKEN is not set"), 503
+
+    env_vars = fs.init_env_vars()
+    try:
+        watches = register_watches(env_vars)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(watches)
+
+
+@app.route("/gmail/push", methods=["POST"])
+def gmail_push():
+    """
+    Pub/Sub push endpoint for Gmail notifications. Ingests only the history
+    delta of the notified mailbox; non-2xx responses make Pub/Sub redeliver.
+    """
+    if not PUSH_TOKEN:
+        return jsonify(error="Push mode is disabled: ABG_PUSH_TOKEN is not set"), 503
+    if not hmac.compare_digest(request.args.get("token", ""), PUSH_TOKEN):
+        return jsonify(error="Invalid push token"), 403
+
+    try:
+        notification = decode_push_envelope(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify(error=f"Invalid push message: {e}"), 400
+
+    env_vars = fs.init_env_vars()
+    with pipeline_lock:
+        try:
+            count = ingest_push_notification(notification, env_vars)
+        except UnknownAccountError as e:
+            # Redelivery cannot fix an unknown mailbox, so acknowledge it
+            logger.warning(f"Ignoring push notification: {e}")
+            return "", 204
+        except Exception as e:
+            # Nothing was acknowledged in the history; Pub/Sub redelivers
+            logger.error(f"Push ingestion failed: {e}", exc_info=True)
+            return jsonify(error="Push ingestion failed"), 500
+    if count:
+        transactions_cache.clear()
+
+    return "", 204
+
+
+# Storage connection of the read endpoints. It is opened (with its schema
+# setup) on first use and then kept for the life of the process; the lock
+# serializes requests on the single connection
+storage_lock = threading.Lock()
+shared_storage = None
+
+
+@contextmanager
+def _storage():
+    global shared_storage
+    with storage_lock:
+        if shared_storage is None:
+            env_vars = fs.init_env_vars()
+            cfg = Config(config_path="config.json", config_dict=env_vars["APP_CONFIG"])
+            shared_storage = open_storage(cfg.get_db_details())
+
+        try:
+            yield shared_storage
+        except (psycopg2.Error, sqlite3.Error):
+            # The connection may be broken; reopen it on the next request
+            try:
+                shared_storage.close()
+            except Exception as e:
+                logger.warning(f"Error closing storage: {e}")
+            shared_storage = None
+            raise
+
+
+@app.route("/summary")
+def spend_summary():
+    """
+    Serves the pre-aggregated (folder, month, vendor) spend summary, optionally
+    for one folder via ?folder=. Responses carry an ETag so unchanged
+    summaries are answered with 304 Not Modified.
+    """
+    with _storage() as storage:
+        rows = storage.get_spend_summary(folder_name=request.args.get("folder"))
+
+    response = jsonify(rows)
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def _parse_transactions_args(args):
+    """
+    Validates the /transactions query string into query_transactions kwargs.
+    Raises ValueError on malformed input.
+    """
+
+    def parse_date(value):
+        return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+    def parse_amount(value):
+        return float(value) if value else None
+
+    after = None
+    if args.get("cursor"):
+        cursor_date, _, cursor_id = args["cursor"].partition("|")
+        if not cursor_date or not cursor_id:
+            raise ValueError("cursor must be <YYYY-MM-DD>|<id>")
+        after = (parse_date(cursor_date), cursor_id)
+
+    limit = int(args.get("limit", 100))
+    if not 1 <= limit <= TRANSACTIONS_PAGE_LIMIT:
+        raise ValueError(f"limit must be between 1 and {TRANSACTIONS_PAGE_LIMIT}")
+
+    return {
+        "folder_name": args.get("folder"),
+        "start_date": parse_date(args.get("start")),
+        "end_date": parse_date(args.get("end")),
+        "vendor_prefix": args.get("vendor"),
+        "min_amount": parse_amount(args.get("min_amount")),
+        "max_amount": parse_amount(args.get("max_amount")),
+        "after": after,
+        "limit": limit,
+    }
+
+
+@app.route("/transactions")
+def transactions():
+    """
+    Lists transactions newest first. Filters: folder, start/end (YYYY-MM-DD),
+    vendor (prefix), min_amount/max_amount. Pages are fetched with the
+    `next_cursor` of the previous response (?cursor=...) and a `limit`.
+    """
+    try:
+        query = _parse_transactions_args(request.args)
+    except ValueError as e:
+        return jsonify(error=f"Invalid query: {e}"), 400
+
+    cache_key = tuple(sorted(request.args.items()))
+    payload = transactions_cache.get(cache_key)
+    if payload is None:
+        with _storage() as storage:
+            rows = storage.query_transactions(**query)
+
+        next_cursor = None
+        if len(rows) == query["limit"]:
+            last = rows[-1]
+            next_cursor = f"{last['transaction_date']}|{last['id']}"
+
+        payload = {"transactions": rows, "next_cursor": next_cursor}
+        transactions_cache.set(cache_key, payload)
+
+    return jsonify(payload)
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port="3000", debug=True)
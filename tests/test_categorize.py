@@ -0,0 +1,36 @@
+from utils.categorize import VendorCategorizer, normalize_vendor
+
+
+def test_normalize_vendor_drops_processor_prefix_and_store_number():
+    assert normalize_vendor("SQ *Blue Bottle Coffee #12") == "BLUE BOTTLE COFFEE"
+
+
+def test_multi_word_tokens_match_whole_phrases_only():
+    categorizer = VendorCategorizer(
+        {
+            "Dining": {"tokens": ["taco bell"]},
+            "Groceries": {"tokens": ["whole foods"]},
+        }
+    )
+
+    assert categorizer.categorize(["BELL CANADA", "WHOLE EARTH PROVISIONS"]) == [
+        None,
+        None,
+    ]
+    assert categorizer.categorize(["TACO BELL #123", "SQ *WHOLE FOODS MKT"]) == [
+        "Dining",
+        "Groceries",
+    ]
+
+
+def test_exact_and_prefix_rules_win_over_tokens():
+    categorizer = VendorCategorizer(
+        {
+            "Coffee": {"exact": ["Blue Bottle"], "tokens": ["market"]},
+            "Groceries": {"prefix": ["Trader Joe"], "tokens": ["coffee"]},
+        }
+    )
+
+    assert categorizer.categorize(
+        ["Blue Bottle", "TRADER JOES COFFEE", "FARMERS MARKET", None]
+    ) == ["Coffee", "Groceries", "Coffee", None]
@@ -0,0 +1,56 @@
+import pytest
+
+from utils.parser import extract_marker_fields, find_matches_from_pattern
+
+MATCH_PATTERN = {
+    "use_regex": False,
+    "amount": ["Purchase amount $", "Purchase date"],
+    "date": ["Purchase date", "Merchant info"],
+    "vendor": ["Merchant info", "Open the"],
+}
+
+
+def _find_each_field(match_pattern, text):
+    # The per-field path matched against text with newlines folded to spaces
+    flat = text.replace("\n", " ")
+    return {
+        name: find_matches_from_pattern(match_pattern[name], flat, pat_type=name)
+        for name in ("amount", "date", "vendor")
+    }
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Purchase amount $12.50\nPurchase date\nJan 5, 2024\nMerchant info\n"
+        "Blue Bottle Coffee\nOpen the app",
+        # Markers split across lines by clean_html
+        "Purchase\namount $1,204.00 Purchase date Feb 29, 2024 Merchant\ninfo "
+        "Trader Joe's Open\nthe app",
+        # KRW amounts are converted
+        "Purchase amount $13,888.80 KRW Purchase date 2024-03-01 Merchant info "
+        "Seoul Coffee Open the app",
+        # Vendors are truncated to 40 characters
+        "Purchase amount $3 Purchase date March 2, 2024 Merchant info "
+        + "A" * 60
+        + " Open the app",
+        # Missing start markers yield empty values
+        "Purchase date March 2, 2024 Merchant info Corner Store",
+        # Repeated markers: the first occurrence wins
+        "Purchase amount $5.00 Purchase date Apr 1, 2024 Merchant info Cafe "
+        "Open the app Purchase amount $9.99 Open the",
+    ],
+)
+def test_marker_extractor_matches_per_field_search(text):
+    assert extract_marker_fields(MATCH_PATTERN, text) == _find_each_field(
+        MATCH_PATTERN, text
+    )
+
+
+def test_unparseable_date_raises_in_both_paths():
+    text = "Purchase amount $5.00 Purchase date soon Merchant info Cafe Open the app"
+
+    with pytest.raises(ValueError):
+        extract_marker_fields(MATCH_PATTERN, text)
+    with pytest.raises(ValueError):
+        _find_each_field(MATCH_PATTERN, text)
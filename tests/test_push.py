@@ -0,0 +1,223 @@
+import base64
+import os
+import shutil
+
+import pytest
+
+import gmail_client
+import server
+from gmail_client import HISTORY_ID_KEY, GmailClient
+from utils.notify import build_push_envelope
+from utils.storage import open_storage
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PUSH_TOKEN = "secret"
+
+EMAIL_HTML = (
+    "<html><body><p>Purchase amount $12.50</p><p>Purchase date Jan 5, 2024</p>"
+    "<p>Merchant info Blue Bottle Coffee</p><p>Open the app</p></body></html>"
+)
+
+
+class _Request:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class FakeGmailService:
+    """
+    Stands in for the Gmail API resource: one mailbox whose history adds one
+    message to the watched label and one to the inbox only.
+    """
+
+    def __init__(self, history_id="150", message_error=None):
+        self.history_id = history_id
+        self.message_error = message_error
+        self.history_requests = []
+
+    def users(self):
+        return self
+
+    def labels(self):
+        return self
+
+    def history(self):
+        return _HistoryResource(self)
+
+    def messages(self):
+        return _MessagesResource(self)
+
+    def getProfile(self, userId):
+        return _Request({"historyId": self.history_id})
+
+    def list(self, userId):
+        return _Request({"labels": [{"id": "Label_1", "name": "CC_Venmo"}]})
+
+
+class _HistoryResource:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, **kwargs):
+        self.service.history_requests.append(kwargs)
+        added = [
+            {"message": {"id": "m1", "labelIds": ["INBOX", "Label_1"]}},
+            {"message": {"id": "m2", "labelIds": ["INBOX"]}},
+        ]
+        return _Request(
+            {
+                "history": [{"id": "140", "messagesAdded": added}],
+                "historyId": self.service.history_id,
+            }
+        )
+
+
+class _MessagesResource:
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, userId, id, format):
+        if self.service.message_error:
+            return _Request(self.service.message_error)
+        data = base64.urlsafe_b64encode(EMAIL_HTML.encode("utf-8")).decode("ascii")
+        return _Request(
+            {"id": id, "payload": {"mimeType": "text/html", "body": {"data": data}}}
+        )
+
+
+@pytest.fixture
+def push_env(tmp_path, monkeypatch):
+    """
+    Runs the webhook against a SQLite database and a fake Gmail service in a
+    temporary working directory. Returns the service, the database path and
+    the account's API cache path.
+    """
+    # The schema seed script is read from the working directory
+    shutil.copy(os.path.join(REPO_ROOT, "db_init_sqlite.sql"), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    db_path = str(tmp_path / "autobudget.db")
+    app_config = {
+        "database_details": {"backend": "sqlite", "path": db_path},
+        "accounts": [
+            {
+                "name": "personal",
+                "email_address": "me@example.com",
+                "clients": [
+                    {
+                        "type": "gmail",
+                        "folder": "CC_Venmo",
+                        "match_pattern": {
+                            "use_regex": False,
+                            "amount": ["Purchase amount $", "Purchase date"],
+                            "date": ["Purchase date", "Merchant info"],
+                            "vendor": ["Merchant info", "Open the"],
+                        },
+                    }
+                ],
+            },
+            {
+                "name": "work",
+                "email_address": "work@example.com",
+                "clients": [{"type": "gmail", "folder": "CC_Work"}],
+            },
+        ],
+    }
+    env_vars = {
+        "APP_CONFIG": app_config,
+        "GOOGLE_TOKEN": None,
+        "GOOGLE_CREDENTIALS": None,
+    }
+    monkeypatch.setattr(server.fs, "init_env_vars", lambda: env_vars)
+    monkeypatch.setattr(server, "PUSH_TOKEN", PUSH_TOKEN)
+    monkeypatch.setattr(gmail_client.time, "sleep", lambda seconds: None)
+
+    service = FakeGmailService()
+
+    class FakeGmailClient(GmailClient):
+        def _init_creds(self, *args, **kwargs):
+            return None
+
+        def _open_service(self):
+            return service
+
+    monkeypatch.setattr(gmail_client, "GmailClient", FakeGmailClient)
+    return service, db_path, tmp_path / "cache_personal.json"
+
+
+def _push(email_address="me@example.com", history_id="145", token=PUSH_TOKEN):
+    return server.app.test_client().post(
+        f"/gmail/push?token={token}",
+        json=build_push_envelope(email_address, history_id),
+    )
+
+
+def _set_history_id(cache_path, history_id):
+    cache = gmail_client.Cache(path=str(cache_path))
+    cache.set(HISTORY_ID_KEY, history_id)
+
+
+def _stored_ids(db_path):
+    storage = open_storage({"backend": "sqlite", "path": db_path})
+    try:
+        return [row[0] for row in storage.query("SELECT id FROM messages", ())]
+    finally:
+        storage.close()
+
+
+def test_push_ingests_the_history_delta(push_env):
+    service, db_path, cache_path = push_env
+    _set_history_id(cache_path, "100")
+
+    res = _push()
+
+    assert res.status_code == 204
+    assert _stored_ids(db_path) == ["m1"]
+    # One unfiltered listing; the cursor moves to Gmail's history ID, not the
+    # notified one
+    assert "labelId" not in service.history_requests[0]
+    assert gmail_client.Cache(path=str(cache_path)).get(HISTORY_ID_KEY) == "150"
+
+
+def test_push_failure_keeps_the_history_id(push_env):
+    service, db_path, cache_path = push_env
+    _set_history_id(cache_path, "100")
+    service.message_error = RuntimeError("backend unavailable")
+
+    res = _push()
+
+    assert res.status_code == 500
+    assert _stored_ids(db_path) == []
+    assert gmail_client.Cache(path=str(cache_path)).get(HISTORY_ID_KEY) == "100"
+
+
+def test_push_at_or_below_the_cursor_is_skipped(push_env):
+    service, _, cache_path = push_env
+    _set_history_id(cache_path, "150")
+
+    assert _push(history_id="150").status_code == 204
+    assert service.history_requests == []
+
+
+def test_push_for_unknown_mailbox_is_acknowledged(push_env):
+    assert _push(email_address="someone@example.com").status_code == 204
+
+
+def test_push_rejects_bad_token_and_envelope(push_env):
+    assert _push(token="wrong").status_code == 403
+
+    res = server.app.test_client().post(
+        f"/gmail/push?token={PUSH_TOKEN}", json={"message": {}}
+    )
+    assert res.status_code == 400
+
+
+def test_push_endpoints_are_disabled_without_token(push_env, monkeypatch):
+    monkeypatch.setattr(server, "PUSH_TOKEN", None)
+
+    assert _push().status_code == 503
+    assert server.app.test_client().get("/watch").status_code == 503
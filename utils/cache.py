@@ -1,13 +1,19 @@
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
 
 
 class Cache:
     """A simple cache that stores key-value pairs in a JSON file."""
 
-    def __init__(self, path="cache.json"):
+    def __init__(self, path="cache.json", autosave=True):
         self.path = path
+        self.autosave = autosave
         self.cache = None
+        # Writes may come from background threads (e.g. label map refreshes)
+        self.lock = threading.RLock()
 
         self.init()
 
@@ -23,17 +29,65 @@ class Cache:
         return None
 
     def set(self, key, value):
-        self.cache[key] = value
+        with self.lock:
+            self.cache[key] = value
+            if self.autosave:
+                self._save()
+
+    def save(self):
+        """Writes the cache to disk; needed when autosave is turned off."""
         self._save()
 
     def clear(self):
-        self.cache = {}
-        self._save()
+        with self.lock:
+            self.cache = {}
+            self._save()
 
     def _save(self):
-        with open(self.path, "w") as f:
-            json.dump(self.cache, f)
+        # Write a temp file and swap it in, so a process killed mid-write
+        # leaves the previous cache intact instead of a truncated file
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with self.lock:
+            with open(tmp_path, "w") as f:
+                json.dump(self.cache, f)
+            os.replace(tmp_path, self.path)
 
     def _load(self, path):
         with open(path, "r") as f:
             self.cache = json.load(f)
+
+
+class LRUCache:
+    """
+    A small in-memory LRU cache with an optional per-entry time-to-live.
+    Thread-safe, so it can be shared by concurrent request handlers.
+    """
+
+    def __init__(self, maxsize=256, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
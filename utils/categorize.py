@@ -0,0 +1,154 @@
+import logging
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.transactions import TransactionBatch
+
+logger = logging.getLogger(__name__)
+
+# Card processor prefixes that precede the actual merchant name
+PROCESSOR_PREFIX_RE = re.compile(r"^(?:SQ|TST|SP|PY|PP|IC|DD)\s*\*\s*")
+# Store numbers (#1234) and standalone digit runs carry no merchant information
+STORE_NUMBER_RE = re.compile(r"#\s*\d+|\b\d+\b")
+NON_WORD_RE = re.compile(r"[^A-Z0-9&]+")
+
+
+def normalize_vendor(vendor: str) -> str:
+    """
+    Normalizes a raw vendor string for matching, e.g.
+    "SQ *Blue Bottle Coffee #12" -> "BLUE BOTTLE COFFEE".
+    """
+    name = vendor.upper().strip().replace("'", "")
+    name = PROCESSOR_PREFIX_RE.sub("", name)
+    name = STORE_NUMBER_RE.sub(" ", name)
+    return " ".join(NON_WORD_RE.sub(" ", name).split())
+
+
+class VendorCategorizer:
+    """
+    Assigns categories to batches of vendor names using the config's category
+    rules, e.g. {"Groceries": {"exact": [...], "prefix": [...], "tokens": [...]}}.
+
+    Rules are compiled once into an exact map, a prefix map (checked longest
+    prefix first) and a token -> category weight matrix. A token may span
+    several words ("whole foods") and only matches as a whole phrase. Vendors
+    not resolved by the exact/prefix maps are scored in one matrix product
+    over the whole batch, and every result is memoized by normalized vendor
+    name.
+    """
+
+    def __init__(self, rules: Dict[str, Dict[str, List[str]]]):
+        self.categories = list(rules)
+        self.exact: Dict[str, str] = {}
+        self.prefixes: Dict[str, str] = {}
+        self.token_ids: Dict[str, int] = {}
+        self.max_token_words = 0
+        token_categories = []
+
+        for category, rule in rules.items():
+            for name in rule.get("exact", []):
+                self.exact[normalize_vendor(name)] = category
+            for prefix in rule.get("prefix", []):
+                self.prefixes[normalize_vendor(prefix)] = category
+            for token in rule.get("tokens", []):
+                token = normalize_vendor(token)
+                if not token:
+                    continue
+                if token not in self.token_ids:
+                    self.token_ids[token] = len(self.token_ids)
+                self.max_token_words = max(self.max_token_words, len(token.split()))
+                token_categories.append(
+                    (self.token_ids[token], self.categories.index(category))
+                )
+
+        # Distinct prefix lengths, longest first, so lookups are a few dict hits
+        self.prefix_lengths = sorted({len(p) for p in self.prefixes}, reverse=True)
+
+        self.weights = np.zeros(
+            (len(self.token_ids), len(self.categories)), dtype=np.float32
+        )
+        for token_id, category_id in token_categories:
+            self.weights[token_id, category_id] += 1.0
+
+        self.memo: Dict[str, Optional[str]] = {}
+
+    def _lookup(self, name: str) -> Optional[str]:
+        category = self.exact.get(name)
+        if category:
+            return category
+        for length in self.prefix_lengths:
+            if len(name) >= length:
+                category = self.prefixes.get(name[:length])
+                if category:
+                    return category
+        return None
+
+    def categorize(self, vendors: List[str]) -> List[Optional[str]]:
+        """
+        Returns the category (or None) for each vendor of the batch.
+        """
+        names = [normalize_vendor(vendor or "") for vendor in vendors]
+
+        # Resolve memoized, exact and prefix matches; collect the rest
+        unresolved: Dict[str, int] = {}
+        for name in names:
+            if name in self.memo or name in unresolved:
+                continue
+            category = self._lookup(name)
+            if category:
+                self.memo[name] = category
+            else:
+                unresolved[name] = len(unresolved)
+
+        if unresolved:
+            self._score_tokens(list(unresolved))
+
+        return [self.memo.get(name) for name in names]
+
+    def _score_tokens(self, names: List[str]):
+        if not self.token_ids:
+            self.memo.update(dict.fromkeys(names))
+            return
+
+        # Sparse (vendor, token) incidence as index arrays -> dense 0/1 matrix.
+        # Tokens are looked up as every word n-gram up to the longest token
+        rows, cols = [], []
+        for row, name in enumerate(names):
+            words = name.split()
+            phrases = {
+                " ".join(words[start : start + n])
+                for n in range(1, self.max_token_words + 1)
+                for start in range(len(words) - n + 1)
+            }
+            for phrase in phrases:
+                token_id = self.token_ids.get(phrase)
+                if token_id is not None:
+                    rows.append(row)
+                    cols.append(token_id)
+
+        incidence = np.zeros((len(names), len(self.token_ids)), dtype=np.float32)
+        incidence[rows, cols] = 1.0
+
+        scores = incidence @ self.weights
+        best = scores.argmax(axis=1)
+        matched = scores.max(axis=1) > 0
+
+        for name, category_id, has_match in zip(names, best, matched):
+            self.memo[name] = self.categories[category_id] if has_match else None
+
+
+def categorize_transactions(
+    transactions: TransactionBatch, categorizer: VendorCategorizer
+) -> TransactionBatch:
+    """
+    Pipeline stage: sets the category column of the whole batch.
+    """
+    transactions.categories = categorizer.categorize(transactions.vendors)
+
+    logger.info(
+        f"Categorized {sum(c is not None for c in transactions.categories)}/"
+        f"{len(transactions)} transactions."
+    )
+    return transactions
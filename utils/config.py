@@ -1,5 +1,5 @@
 import json
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
 
 
 class Config:
@@ -74,35 +74,88 @@ class Config:
         else:
             print(json.dumps(contents, indent=2))
 
-    def get_email_clients(self, type=None) -> List[Dict[str, str]]:
+    def get_accounts(self) -> List[Dict]:
+        """
+        Returns the mailbox accounts from the config file. Each account has a
+        "name", its credentials ("token_path"/"credentials_path", or inline
+        "token"/"credentials" dicts), API cache paths and its own "clients".
+        A config without "accounts" is treated as one account named "default"
+        that uses the top-level "clients" and the original file paths.
+        Returns:
+            List[Dict]: A list of accounts with defaults filled in.
+        Raises:
+            ValueError: Raised if two accounts use the same folder name, as
+            folders (and their match patterns) are identified by name alone.
+        """
+        if "accounts" not in self.items:
+            return [
+                {
+                    "name": "default",
+                    "token_path": "token.json",
+                    "credentials_path": "credentials.json",
+                    "cache_path": "cache.json",
+                    "parse_cache_path": "parse_cache.json",
+                    "clients": self.items["clients"],
+                }
+            ]
+
+        accounts = []
+        for account in self.items["accounts"]:
+            name = account["name"]
+            accounts.append(
+                {
+                    "token_path": f"token_{name}.json",
+                    "credentials_path": "credentials.json",
+                    "cache_path": f"cache_{name}.json",
+                    "parse_cache_path": f"parse_cache_{name}.json",
+                    **account,
+                }
+            )
+
+        folder_owners: Dict[str, str] = {}
+        for account in accounts:
+            for client in account["clients"]:
+                owner = folder_owners.setdefault(client["folder"], account["name"])
+                if owner != account["name"]:
+                    raise ValueError(
+                        f"Folder name '{client['folder']}' is used by accounts "
+                        f"'{owner}' and '{account['name']}'"
+                    )
+        return accounts
+
+    def _get_clients(self, account=None) -> List[Dict]:
+        clients = []
+        for acct in self.get_accounts():
+            if account is None or acct["name"] == account:
+                clients.extend(acct["clients"])
+        return clients
+
+    def get_email_clients(self, type=None, account=None) -> List[Dict[str, str]]:
         """
         Returns a list of email clients from the config file.
         Args:
             type (str): Only return clients of this type.
+            account (str): Only return clients of this account.
         Returns:
             List[Dict[str, str]]: A list of email clients.
         """
+        clients = self._get_clients(account)
         if type is None:
-            return self.items["clients"]
-        return [
-            client for client in self.items["clients"] if client["type"] == type
-        ]
+            return clients
+        return [client for client in clients if client["type"] == type]
 
-    def get_folders(self, type=None) -> List[str]:
+    def get_folders(self, type=None, account=None) -> List[str]:
         """
         Returns a list of folders to extract emails from the config file.
         Flatten the list of folders.
         Args:
             type (str): Only return folders of clients of this type.
+            account (str): Only return folders of this account.
         Returns:
             List[str]: A list of folders.
         """
-        if type is None:
-            return [client["folder"] for client in self.items["clients"]]
         return [
-            client["folder"]
-            for client in self.items["clients"]
-            if client["type"] == type
+            client["folder"] for client in self.get_email_clients(type, account)
         ]
 
     def get_match_pattern(
@@ -119,7 +172,7 @@ class Config:
         Raises:
             IndexError: Raised if the input folder name does not exist.
         """
-        for client in self.items["clients"]:
+        for client in self._get_clients():
             if client["folder"] == folder_name:
                 return client["match_pattern"]
 
@@ -132,3 +185,29 @@ class Config:
             Dict[str, str]: The database configuration items.
         """
         return self.items["database_details"]
+
+    def get_message_format(self) -> str:
+        """
+        Get the Gmail message transfer format ("full" or "raw").
+        Returns:
+            str: The configured format, "full" by default.
+        """
+        return self.items.get("message_format", "full")
+
+    def get_categories(self) -> Dict[str, Dict[str, List[str]]]:
+        """
+        Get the vendor categorization rules, keyed by category name.
+        Returns:
+            Dict[str, Dict[str, List[str]]]: Each category's "exact", "prefix"
+            and "tokens" vendor rules. Empty if categorization is not set up.
+        """
+        return self.items.get("categories", {})
+
+    def get_push_topic(self) -> Optional[str]:
+        """
+        Get the Cloud Pub/Sub topic that Gmail push notifications are sent to.
+        Returns:
+            Optional[str]: The full topic name ("projects/<id>/topics/<name>"),
+            or None if push mode is not set up.
+        """
+        return self.items.get("push", {}).get("topic")
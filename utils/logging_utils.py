@@ -1,18 +1,66 @@
 import logging
+from collections import deque
 
-class ListHandler(logging.Handler):
+
+class RingBufferHandler(logging.Handler):
     """
-    A logging handler that appends log records to a list.
-    This allows retrieving logs programmatically after execution.
+    A logging handler that keeps only the most recent log records in memory.
+    Records are stored as small dicts in a fixed-size ring buffer, and every
+    formatted line is streamed straight to an optional log file so nothing is
+    lost once the buffer wraps around.
     """
-    def __init__(self, log_list):
+    def __init__(self, capacity=1000, log_path=None, max_message_length=2000):
         super().__init__()
-        self.log_list = log_list
+        self.records = deque(maxlen=capacity)
+        self.max_message_length = max_message_length
+        self.log_path = log_path
+        self.stream = open(log_path, "a", encoding="utf-8") if log_path else None
+        self.dropped = 0
 
     def emit(self, record):
         try:
             msg = self.format(record)
-            self.log_list.append(msg)
+            # Long messages (e.g. logged SQL carrying full email bodies) are
+            # clipped in the buffer so a single record cannot blow it up; the
+            # log file still gets the full line
+            buffered_msg = msg
+            if len(msg) > self.max_message_length:
+                buffered_msg = msg[: self.max_message_length] + " ...[truncated]"
+
+            if len(self.records) == self.records.maxlen:
+                self.dropped += 1
+            self.records.append(
+                {
+                    "created": record.created,
+                    "name": record.name,
+                    "level": record.levelname,
+                    "message": buffered_msg,
+                }
+            )
+
+            if self.stream:
+                self.stream.write(f"{msg}\n")
+                self.stream.flush()
         except Exception:
             self.handleError(record)
 
+    def lines(self):
+        """
+        Returns the formatted lines currently held in the buffer, oldest first.
+        """
+        lines = [rec["message"] for rec in self.records]
+        if self.dropped:
+            lines.insert(
+                0, f"... {self.dropped} earlier log lines omitted (see log file)"
+            )
+        return lines
+
+    def close(self):
+        self.acquire()
+        try:
+            if self.stream:
+                self.stream.close()
+                self.stream = None
+        finally:
+            self.release()
+        super().close()
@@ -0,0 +1,66 @@
+import base64
+import email
+import email.policy
+from email.message import Message
+from typing import Any, Dict, Optional
+
+
+def decode_base64url(data: str) -> bytes:
+    """
+    Decodes Gmail's unpadded base64url data straight into bytes.
+    """
+    padding_needed = (-len(data)) % 4
+    if padding_needed:
+        data += "=" * padding_needed
+    return base64.urlsafe_b64decode(data)
+
+
+def find_body_part(
+    payload: Dict[str, Any], mime_type: str = "text/html"
+) -> Optional[Dict[str, Any]]:
+    """
+    Walks a Gmail message payload (arbitrarily nested multipart/* parts) in
+    document order and returns the first part of the given MIME type that
+    carries inline body data.
+    """
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        if part.get("mimeType") == mime_type and part.get("body", {}).get("data"):
+            return part
+        # Push children reversed so they are visited in their original order
+        stack.extend(reversed(part.get("parts", [])))
+    return None
+
+
+def part_charset(part: Dict[str, Any], default: str = "utf-8") -> str:
+    """
+    Returns the charset declared in a payload part's Content-Type header.
+    """
+    for header in part.get("headers", []):
+        if header.get("name", "").lower() == "content-type":
+            msg = Message()
+            msg["Content-Type"] = header.get("value", "")
+            return msg.get_content_charset(default)
+    return default
+
+
+def decode_part(part: Dict[str, Any]) -> str:
+    """
+    Decodes a payload part's body data using the part's declared charset.
+    Raises binascii.Error, UnicodeDecodeError or LookupError on bad input.
+    """
+    return decode_base64url(part["body"]["data"]).decode(part_charset(part))
+
+
+def decode_raw_message(raw: str, subtype: str = "html") -> Optional[str]:
+    """
+    Parses a `format="raw"` Gmail message (base64url RFC 822 bytes) with the
+    stdlib email package and returns its first text/<subtype> body, decoded
+    with the part's charset.
+    """
+    msg = email.message_from_bytes(decode_base64url(raw), policy=email.policy.default)
+    body = msg.get_body(preferencelist=(subtype,))
+    if body is None or body.get_content_subtype() != subtype:
+        return None
+    return body.get_content()
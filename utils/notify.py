@@ -0,0 +1,97 @@
+"""
+Gmail push notifications arrive as Cloud Pub/Sub push messages, e.g.
+{"message": {"data": base64('{"emailAddress": ..., "historyId": ...}'),
+"messageId": ...}, "subscription": ...}. This module decodes them, and its
+LocalNotifier stands in for Pub/Sub to drive the webhook locally or in tests.
+"""
+import argparse
+import base64
+import binascii
+import json
+import time
+from typing import Any, Dict, Optional
+
+import requests
+
+
+def build_push_envelope(
+    email_address: str,
+    history_id: str,
+    subscription: str = "projects/local/subscriptions/autobudget",
+) -> Dict[str, Any]:
+    """
+    Builds the Pub/Sub push message Gmail sends for a mailbox change.
+    """
+    data = json.dumps({"emailAddress": email_address, "historyId": history_id})
+    return {
+        "message": {
+            "data": base64.b64encode(data.encode("utf-8")).decode("ascii"),
+            "messageId": str(time.time_ns()),
+        },
+        "subscription": subscription,
+    }
+
+
+def decode_push_envelope(envelope: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Returns the Gmail notification ({"emailAddress", "historyId"}) carried by
+    a Pub/Sub push message. Raises ValueError on malformed input.
+    """
+    try:
+        data = base64.b64decode(envelope["message"]["data"])
+        notification = json.loads(data)
+    except (KeyError, TypeError, binascii.Error, ValueError) as e:
+        raise ValueError(f"not a Pub/Sub push message ({e})") from e
+
+    if not isinstance(notification, dict) or not {
+        "emailAddress",
+        "historyId",
+    } <= notification.keys():
+        raise ValueError("missing emailAddress/historyId")
+    return notification
+
+
+class LocalNotifier:
+    """
+    Posts Gmail-style push messages to the webhook, like a Pub/Sub push
+    subscription would. `token` is the webhook's shared verification token.
+    """
+
+    def __init__(
+        self,
+        url: str = "http://localhost:3000/gmail/push",
+        token: Optional[str] = None,
+    ):
+        self.url = url
+        self.token = token
+
+    def notify(self, email_address: str, history_id: str) -> int:
+        """
+        Sends one notification and returns the webhook's HTTP status code.
+        """
+        params = {"token": self.token} if self.token else None
+        res = requests.post(
+            self.url,
+            json=build_push_envelope(email_address, history_id),
+            params=params,
+            timeout=600,
+        )
+        return res.status_code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Send a Gmail-style push notification to the webhook."
+    )
+    parser.add_argument("email_address", help="Mailbox that changed.")
+    parser.add_argument("history_id", help="Mailbox history ID to report.")
+    parser.add_argument(
+        "--url",
+        default="http://localhost:3000/gmail/push",
+        help="Webhook URL (default: http://localhost:3000/gmail/push).",
+    )
+    parser.add_argument("--token", help="Webhook verification token.")
+    args = parser.parse_args()
+
+    notifier = LocalNotifier(url=args.url, token=args.token)
+    print(notifier.notify(args.email_address, args.history_id))
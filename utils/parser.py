@@ -1,5 +1,8 @@
+import hashlib
+import json
 import logging
 import re
+from functools import lru_cache
 
 from bs4 import BeautifulSoup
 from dateutil.parser import parse as date_parse, ParserError as DateParserError
@@ -31,6 +34,15 @@ def clean_html(html):
     return text
 
 
+def pattern_fingerprint(match_pattern):
+    """
+    Returns a stable hash of a folder's match pattern, used to invalidate
+    memoized parse results whenever the pattern is edited.
+    """
+    encoded = json.dumps(match_pattern, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()
+
+
 def apply_regex(s, reg):
     regex = re.compile(reg)
     matches = regex.search(s)
@@ -66,6 +78,17 @@ def find_matches_from_pattern(pat, s, pat_type=None, use_regex=False):
 
         result = s[start_i:end_i].strip()
 
+    return finalize_match(result, s, pat_type=pat_type)
+
+
+def finalize_match(result, s, pat_type=None):
+    """
+    Converts a raw extracted string into its typed value for the given field.
+    Args:
+        result (str): The raw text found between the field's markers.
+        s (str): The full text the result was extracted from.
+        pat_type (str): One of "amount", "date" or "vendor".
+    """
     # Truncate the length of the vendor name to no more than 40 chars
     if pat_type == "vendor":
         if len(result) > 40:
@@ -97,3 +120,101 @@ def find_matches_from_pattern(pat, s, pat_type=None, use_regex=False):
             return 0.0
 
     return result
+
+
+def _marker_regex(marker):
+    # Cleaned text keeps its line breaks, so a space in a marker also matches
+    # a newline (the old code replaced newlines with spaces before matching)
+    return re.escape(marker).replace("\\ ", "[ \\n]")
+
+
+class MarkerExtractor:
+    """
+    Extracts every delimiter-based field of a match pattern in a single scan.
+    All start and end markers are combined into one lookahead alternation, so
+    one pass over the text yields the offsets of each field without slicing
+    copies of the text or rescanning it per field.
+    """
+
+    def __init__(self, fields):
+        # fields: tuple of (field name, start marker, end marker)
+        self.fields = fields
+        markers = {marker for _, start, end in fields for marker in (start, end)}
+        self.marker_res = {
+            marker: re.compile(_marker_regex(marker)) for marker in markers
+        }
+        alternation = "|".join(
+            _marker_regex(marker) for marker in sorted(markers, key=len, reverse=True)
+        )
+        self.scanner = re.compile(f"(?=(?:{alternation}))")
+
+    def extract(self, s):
+        """
+        Returns a dict of field name -> raw text between its markers, or None
+        for fields whose start marker does not occur in the text. A field whose
+        end marker is missing yields an empty string.
+        """
+        results = {}
+        # Field name -> offset right after its start marker, once found
+        value_starts = {}
+        remaining = len(self.fields)
+
+        for hit in self.scanner.finditer(s):
+            pos = hit.start()
+            for name, start, end in self.fields:
+                if name in results:
+                    continue
+                if name not in value_starts:
+                    match = self.marker_res[start].match(s, pos)
+                    if match:
+                        value_starts[name] = match.end()
+                elif pos >= value_starts[name] and self.marker_res[end].match(
+                    s, pos
+                ):
+                    results[name] = s[value_starts[name] : pos]
+                    remaining -= 1
+
+            if not remaining:
+                break
+
+        for name, _, _ in self.fields:
+            if name not in results:
+                results[name] = "" if name in value_starts else None
+            else:
+                results[name] = results[name].replace("\n", " ")
+
+        return results
+
+
+@lru_cache(maxsize=64)
+def _compile_marker_extractor(fields):
+    return MarkerExtractor(fields)
+
+
+def get_marker_extractor(match_pattern, field_names=("amount", "date", "vendor")):
+    """
+    Returns the (cached) single-pass extractor for a delimiter-based pattern.
+    """
+    fields = tuple(
+        (name, match_pattern[name][0], match_pattern[name][1]) for name in field_names
+    )
+    return _compile_marker_extractor(fields)
+
+
+def extract_marker_fields(match_pattern, s):
+    """
+    Extracts the amount, date and vendor fields of a delimiter-based pattern
+    from `s` in one pass. Returns the same values `find_matches_from_pattern`
+    would return for each field.
+    """
+    raw = get_marker_extractor(match_pattern).extract(s)
+    fields = {}
+    for name, result in raw.items():
+        if result is None:
+            logger.debug(
+                f"Start pattern '{match_pattern[name][0]}' not found in string."
+            )
+            fields[name] = ""
+        else:
+            fields[name] = finalize_match(result.strip(), s, pat_type=name)
+    return fields
@@ -0,0 +1,873 @@
+import csv
+import logging
+import re
+import sqlite3
+from abc import ABC, abstractmethod
+from datetime import date
+from typing import Any, Dict, IO, Iterable, List, Optional, Set, Tuple
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from utils.db import DatabaseConnector
+
+logger = logging.getLogger(__name__)
+
+# (folder id, last transaction date)
+FolderInfo = Tuple[int, Optional[date]]
+
+# (id, folder_id, content, transaction_date, transaction_vendor,
+#  transaction_amount, category)
+MessageRow = Tuple[str, int, str, date, str, float, Optional[str]]
+
+Shard = Tuple[date, date]
+
+# (folder id, month, vendor) -> (transaction count, total amount)
+SpendDeltas = Dict[Tuple[int, date, str], Tuple[int, float]]
+
+
+def aggregate_spend(rows: Iterable[MessageRow]) -> SpendDeltas:
+    """
+    Aggregates message rows into per (folder, month, vendor) spend deltas.
+    """
+    deltas: SpendDeltas = {}
+    for _, folder_id, _, trans_date, vendor, amount, _ in rows:
+        key = (folder_id, trans_date.replace(day=1), vendor)
+        count, total = deltas.get(key, (0, 0.0))
+        deltas[key] = (count + 1, total + float(amount))
+    return deltas
+
+
+class Storage(ABC):
+    """
+    Storage interface used by the pipeline, reprocessing, backfill and export
+    scripts. Each backend implements the folder, message, watermark and
+    backfill checkpoint operations for its own database.
+    """
+
+    @abstractmethod
+    def sync_folders(
+        self, folder_names: Iterable[str], email_server: str = "gmail"
+    ) -> Dict[str, FolderInfo]:
+        """
+        Creates any missing folders and returns folder name -> (id, last
+        transaction date) for the given folders.
+        """
+
+    @abstractmethod
+    def get_ingested_message_ids(self, folder_names: List[str]) -> Set[str]:
+        """Returns the IDs of the stored messages of the given folders."""
+
+    @abstractmethod
+    def get_stored_message_folders(self, folder_names: List[str]) -> Dict[str, str]:
+        """Returns message id -> folder name for the given folders."""
+
+    @abstractmethod
+    def write_messages(self, rows: List[MessageRow], upsert: bool = False):
+        """
+        Inserts message rows in bulk. Existing IDs are left alone, or have their
+        extracted fields overwritten with `upsert`. The spend summary is kept
+        in sync in the same transaction.
+        """
+
+    @abstractmethod
+    def rebuild_spend_summary(self, folder_ids: Optional[List[int]] = None):
+        """
+        Recomputes the spend summary from `messages` for the given folders (or
+        all folders). Only needed when existing rows change.
+        """
+
+    @abstractmethod
+    def get_spend_summary(
+        self, folder_name: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns the (folder, month, vendor) spend summary rows, newest month
+        first, optionally for a single folder.
+        """
+
+    @abstractmethod
+    def refresh_watermarks(self):
+        """Sets each folder's last transaction date from its stored messages."""
+
+    @abstractmethod
+    def record_backfill_shards(self, folder_name: str, shards: List[Shard]):
+        """Registers backfill shards; shards from earlier runs are kept as-is."""
+
+    @abstractmethod
+    def get_completed_backfill_shards(self, folder_name: str) -> Set[Shard]:
+        """Returns the shards of a folder whose backfill has completed."""
+
+    @abstractmethod
+    def mark_backfill_shard(
+        self,
+        folder_name: str,
+        shard: Shard,
+        status: str,
+        message_count: Optional[int] = None,
+    ):
+        """Updates the checkpoint status of one backfill shard."""
+
+    @abstractmethod
+    def query_transactions(
+        self,
+        folder_name: Optional[str] = None,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        vendor_prefix: Optional[str] = None,
+        min_amount: Optional[float] = None,
+        max_amount: Optional[float] = None,
+        after: Optional[Tuple[date, str]] = None,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns up to `limit` transactions matching the filters, newest first.
+        Pagination is keyset-based: pass the (transaction_date, id) of the last
+        row of the previous page as `after`.
+        """
+
+    @abstractmethod
+    def export_messages_csv(self, f: IO[str]):
+        """Writes the messages table to `f` as CSV with a header row."""
+
+    @abstractmethod
+    def query(self, sql: str, params: Tuple[Any, ...] = ()) -> List[Tuple]:
+        """Runs a read-only (e.g. reporting) query and returns all rows."""
+
+    @abstractmethod
+    def close(self):
+        """Closes the database connection."""
+
+
+class PostgresStorage(Storage):
+    """Storage backed by a (remote) PostgreSQL database."""
+
+    def __init__(self, db_name, host, user, password, port):
+        self.db = DatabaseConnector(
+            db_name=db_name, host=host, user=user, password=password, port=port
+        )
+        self.conn = self.db.conn
+        self._ensure_category_column()
+        self._ensure_unique_folder_names()
+        self._ensure_spend_summary()
+
+    def _ensure_category_column(self):
+        # Add columns newer than the db only when missing: ALTER TABLE locks
+        # `messages` exclusively even when the column already exists
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_schema = current_schema()
+                        AND table_name = 'messages'
+                        AND column_name = 'category'
+                )
+                """
+            )
+            if not cursor.fetchone()[0]:
+                cursor.execute("ALTER TABLE messages ADD COLUMN category text")
+
+    def _ensure_unique_folder_names(self):
+        # Concurrent writers (e.g. backfill shards) must not create the same
+        # folder twice. Older databases may already hold duplicates
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('folders_folder_name_idx')")
+            if cursor.fetchone()[0] is not None:
+                return
+            try:
+                cursor.execute(
+                    "CREATE UNIQUE INDEX folders_folder_name_idx "
+                    "ON folders (folder_name)"
+                )
+            except psycopg2.Error as e:
+                logger.warning(f"Could not make folder names unique: {e}")
+
+    def _ensure_spend_summary(self):
+        # Populate the summary once for databases that predate it
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT NOT EXISTS (SELECT 1 FROM spend_summary)
+                    AND EXISTS (SELECT 1 FROM messages)
+                """
+            )
+            needs_rebuild = cursor.fetchone()[0]
+        if needs_rebuild:
+            logger.info("Building spend summary from existing messages...")
+            self.rebuild_spend_summary()
+
+    def sync_folders(self, folder_names, email_server="gmail"):
+        select_sql = "SELECT id, last_trans_date FROM folders WHERE folder_name = %s"
+        folders = {}
+        with self.conn.cursor() as cursor:
+            for folder_name in folder_names:
+                try:
+                    cursor.execute(select_sql, (folder_name,))
+                    result = cursor.fetchone()
+
+                    if result is None:
+                        # A concurrent writer may create it first; the unique
+                        # index turns that race into a no-op
+                        cursor.execute(
+                            """INSERT INTO folders (email_server, folder_name)
+                            VALUES (%s, %s) ON CONFLICT DO NOTHING""",
+                            (email_server, folder_name),
+                        )
+                        cursor.execute(select_sql, (folder_name,))
+                        result = cursor.fetchone()
+
+                    folders[folder_name] = (result[0], result[1])
+                except Exception as e:
+                    logger.error(f"Error syncing folder '{folder_name}': {e}")
+        return folders
+
+    def get_ingested_message_ids(self, folder_names):
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT m.id
+                FROM messages m
+                JOIN folders f ON f.id = m.folder_id
+                WHERE f.folder_name = ANY(%s)
+                """,
+                (list(folder_names),),
+            )
+            return {row[0] for row in cursor}
+
+    def get_stored_message_folders(self, folder_names):
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT m.id, f.folder_name
+                FROM messages m
+                JOIN folders f ON f.id = m.folder_id
+                WHERE f.folder_name = ANY(%s)
+                """,
+                (list(folder_names),),
+            )
+            return dict(cursor.fetchall())
+
+    def write_messages(self, rows, upsert=False):
+        if upsert:
+            conflict_clause = """DO UPDATE SET
+                transaction_date = EXCLUDED.transaction_date,
+                transaction_vendor = EXCLUDED.transaction_vendor,
+                transaction_amount = EXCLUDED.transaction_amount,
+                category = EXCLUDED.category"""
+        else:
+            conflict_clause = "DO NOTHING"
+
+        with self.conn.cursor() as cursor:
+            cursor.execute("BEGIN")
+            try:
+                inserted = execute_values(
+                    cursor,
+                    f"""
+                    INSERT INTO messages (
+                        id, folder_id, content, transaction_date,
+                        transaction_vendor, transaction_amount, category
+                    )
+                    VALUES %s
+                    ON CONFLICT (id) {conflict_clause}
+                    RETURNING id, folder_id, NULL, transaction_date,
+                        transaction_vendor, transaction_amount, category;
+                    """,
+                    rows,
+                    page_size=500,
+                    fetch=True,
+                )
+
+                if upsert:
+                    # Updated rows may have moved between summary buckets
+                    self._rebuild_spend_summary(
+                        cursor, sorted({row[1] for row in rows})
+                    )
+                else:
+                    self._apply_spend_deltas(cursor, aggregate_spend(inserted))
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+
+    def _apply_spend_deltas(self, cursor, deltas):
+        execute_values(
+            cursor,
+            """
+            INSERT INTO spend_summary (
+                folder_id, month, transaction_vendor,
+                transaction_count, total_amount
+            )
+            VALUES %s
+            ON CONFLICT (folder_id, month, transaction_vendor) DO UPDATE SET
+                transaction_count =
+                    spend_summary.transaction_count + EXCLUDED.transaction_count,
+                total_amount = spend_summary.total_amount + EXCLUDED.total_amount
+            """,
+            [key + value for key, value in deltas.items()],
+        )
+
+    def _rebuild_spend_summary(self, cursor, folder_ids=None):
+        folder_filter = "" if folder_ids is None else "WHERE folder_id = ANY(%s)"
+        params = () if folder_ids is None else (folder_ids,)
+        cursor.execute(f"DELETE FROM spend_summary {folder_filter}", params)
+        cursor.execute(
+            f"""
+            INSERT INTO spend_summary (
+                folder_id, month, transaction_vendor,
+                transaction_count, total_amount
+            )
+            SELECT folder_id, date_trunc('month', transaction_date)::date,
+                transaction_vendor, COUNT(*), SUM(transaction_amount)
+            FROM messages
+            {folder_filter}
+            GROUP BY 1, 2, 3
+            """,
+            params,
+        )
+
+    def rebuild_spend_summary(self, folder_ids=None):
+        with self.conn.cursor() as cursor:
+            cursor.execute("BEGIN")
+            try:
+                self._rebuild_spend_summary(cursor, folder_ids)
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+
+    def get_spend_summary(self, folder_name=None):
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT f.folder_name, s.month, s.transaction_vendor,
+                    s.transaction_count, s.total_amount
+                FROM spend_summary s
+                JOIN folders f ON f.id = s.folder_id
+                WHERE %(folder)s IS NULL OR f.folder_name = %(folder)s
+                ORDER BY s.month DESC, f.folder_name, s.transaction_vendor
+                """,
+                {"folder": folder_name},
+            )
+            return [_summary_row(*row) for row in cursor.fetchall()]
+
+    def refresh_watermarks(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE folders f
+                SET last_trans_date = sub.max_date
+                FROM (
+                    SELECT folder_id, MAX(transaction_date) as max_date
+                    FROM messages
+                    GROUP BY folder_id
+                ) sub
+                WHERE f.id = sub.folder_id;
+                """
+            )
+
+    def record_backfill_shards(self, folder_name, shards):
+        with self.conn.cursor() as cursor:
+            execute_values(
+                cursor,
+                """
+                INSERT INTO backfill_shards (folder_name, shard_start, shard_end)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+                """,
+                [(folder_name, start, end) for start, end in shards],
+            )
+
+    def get_completed_backfill_shards(self, folder_name):
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT shard_start, shard_end FROM backfill_shards
+                WHERE folder_name = %s AND status = 'done'
+                """,
+                (folder_name,),
+            )
+            return set(cursor.fetchall())
+
+    def mark_backfill_shard(self, folder_name, shard, status, message_count=None):
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE backfill_shards
+                SET status = %s, message_count = %s, updated_at = NOW()
+                WHERE folder_name = %s AND shard_start = %s AND shard_end = %s
+                """,
+                (status, message_count, folder_name, shard[0], shard[1]),
+            )
+
+    def query_transactions(
+        self,
+        folder_name=None,
+        start_date=None,
+        end_date=None,
+        vendor_prefix=None,
+        min_amount=None,
+        max_amount=None,
+        after=None,
+        limit=100,
+    ):
+        conditions, params = [], []
+        if folder_name is not None:
+            conditions.append("f.folder_name = %s")
+            params.append(folder_name)
+        if start_date is not None:
+            conditions.append("m.transaction_date >= %s")
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append("m.transaction_date <= %s")
+            params.append(end_date)
+        if vendor_prefix:
+            # Served by the varchar_pattern_ops index on transaction_vendor
+            escaped = re.sub(r"([\\%_])", r"\\\1", vendor_prefix)
+            conditions.append("m.transaction_vendor LIKE %s")
+            params.append(f"{escaped}%")
+        if min_amount is not None:
+            conditions.append("m.transaction_amount >= %s")
+            params.append(min_amount)
+        if max_amount is not None:
+            conditions.append("m.transaction_amount <= %s")
+            params.append(max_amount)
+        if after is not None:
+            conditions.append("(m.transaction_date, m.id) < (%s, %s)")
+            params.extend(after)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT m.id, f.folder_name, m.transaction_date,
+                    m.transaction_vendor, m.transaction_amount, m.category
+                FROM messages m
+                JOIN folders f ON f.id = m.folder_id
+                {where}
+                ORDER BY m.transaction_date DESC, m.id DESC
+                LIMIT %s
+                """,
+                params + [limit],
+            )
+            return [_transaction_row(*row) for row in cursor.fetchall()]
+
+    def export_messages_csv(self, f):
+        with self.conn.cursor() as cursor:
+            copy_sql = "COPY messages TO STDOUT WITH CSV HEADER DELIMITER ','"
+            cursor.copy_expert(copy_sql, f)
+
+    def query(self, sql, params=()):
+        with self.conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+class SQLiteStorage(Storage):
+    """
+    Embedded storage in a local SQLite file, for single-node deployments that
+    do not need a database server. WAL mode lets readers (e.g. exports) run
+    while the pipeline writes.
+    """
+
+    def __init__(self, path="autobudget.db", seed_sql_path="db_init_sqlite.sql"):
+        self.path = path
+        # Callers sharing one storage across threads (e.g. the server's read
+        # endpoints) serialize access themselves
+        self.conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+
+        if seed_sql_path:
+            with open(seed_sql_path, "r") as seed_sql:
+                self.conn.executescript(seed_sql.read())
+
+        # SQLite has no ADD COLUMN IF NOT EXISTS; add columns newer than the db
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(messages)")}
+        if "category" not in columns:
+            self.conn.execute("ALTER TABLE messages ADD COLUMN category text")
+
+        # Concurrent writers (e.g. backfill shards) must not create the same
+        # folder twice. Older databases may already hold duplicates
+        try:
+            self.conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS folders_folder_name_idx "
+                "ON folders (folder_name)"
+            )
+        except sqlite3.IntegrityError as e:
+            logger.warning(f"Could not make folder names unique: {e}")
+
+        # Populate the summary once for databases that predate it
+        needs_rebuild = self.conn.execute(
+            """
+            SELECT NOT EXISTS (SELECT 1 FROM spend_summary)
+                AND EXISTS (SELECT 1 FROM messages)
+            """
+        ).fetchone()[0]
+        if needs_rebuild:
+            logger.info("Building spend summary from existing messages...")
+            self.rebuild_spend_summary()
+
+    @staticmethod
+    def _to_date(value: Optional[str]) -> Optional[date]:
+        return date.fromisoformat(value) if value else None
+
+    @staticmethod
+    def _placeholders(values: List[Any]) -> str:
+        return ", ".join("?" for _ in values)
+
+    def _run_in_transaction(self, sql, rows):
+        # One transaction per batch instead of one commit per row
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany(sql, rows)
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def sync_folders(self, folder_names, email_server="gmail"):
+        select_sql = "SELECT id, last_trans_date FROM folders WHERE folder_name = ?"
+        folders = {}
+        for folder_name in folder_names:
+            try:
+                result = self.conn.execute(select_sql, (folder_name,)).fetchone()
+
+                if result is None:
+                    # A concurrent writer may create it first; the unique index
+                    # turns that race into a no-op
+                    self.conn.execute(
+                        """INSERT INTO folders (email_server, folder_name)
+                        VALUES (?, ?) ON CONFLICT DO NOTHING""",
+                        (email_server, folder_name),
+                    )
+                    result = self.conn.execute(select_sql, (folder_name,)).fetchone()
+
+                folders[folder_name] = (result[0], self._to_date(result[1]))
+            except Exception as e:
+                logger.error(f"Error syncing folder '{folder_name}': {e}")
+        return folders
+
+    def get_ingested_message_ids(self, folder_names):
+        folder_names = list(folder_names)
+        if not folder_names:
+            return set()
+        return {
+            row[0]
+            for row in self.conn.execute(
+                f"""
+                SELECT m.id
+                FROM messages m
+                JOIN folders f ON f.id = m.folder_id
+                WHERE f.folder_name IN ({self._placeholders(folder_names)})
+                """,
+                folder_names,
+            )
+        }
+
+    def get_stored_message_folders(self, folder_names):
+        folder_names = list(folder_names)
+        if not folder_names:
+            return {}
+        return dict(
+            self.conn.execute(
+                f"""
+                SELECT m.id, f.folder_name
+                FROM messages m
+                JOIN folders f ON f.id = m.folder_id
+                WHERE f.folder_name IN ({self._placeholders(folder_names)})
+                """,
+                folder_names,
+            ).fetchall()
+        )
+
+    def write_messages(self, rows, upsert=False):
+        if upsert:
+            conflict_clause = """DO UPDATE SET
+                transaction_date = excluded.transaction_date,
+                transaction_vendor = excluded.transaction_vendor,
+                transaction_amount = excluded.transaction_amount,
+                category = excluded.category"""
+        else:
+            conflict_clause = "DO NOTHING"
+
+        self.conn.execute("BEGIN")
+        try:
+            # Multi-row inserts in pages, returning only the rows actually
+            # inserted (SQLite >= 3.35); executemany() discards RETURNING rows
+            inserted = []
+            for start in range(0, len(rows), 500):
+                page = rows[start : start + 500]
+                params = []
+                for row in page:
+                    mid, folder_id, content, trans_date, vendor, amount, category = row
+                    params += (
+                        mid,
+                        folder_id,
+                        content,
+                        trans_date.isoformat(),
+                        vendor,
+                        amount,
+                        category,
+                    )
+                values = ", ".join(["(?, ?, ?, ?, ?, ?, ?)"] * len(page))
+                cursor = self.conn.execute(
+                    f"""
+                    INSERT INTO messages (
+                        id, folder_id, content, transaction_date,
+                        transaction_vendor, transaction_amount, category
+                    )
+                    VALUES {values}
+                    ON CONFLICT (id) {conflict_clause}
+                    RETURNING id, folder_id, NULL, transaction_date,
+                        transaction_vendor, transaction_amount, category
+                    """,
+                    params,
+                )
+                inserted += [
+                    row[:3] + (self._to_date(row[3]),) + row[4:] for row in cursor
+                ]
+
+            if upsert:
+                # Updated rows may have moved between summary buckets
+                self._rebuild_spend_summary(sorted({row[1] for row in rows}))
+            else:
+                self._apply_spend_deltas(aggregate_spend(inserted))
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def _apply_spend_deltas(self, deltas):
+        self.conn.executemany(
+            """
+            INSERT INTO spend_summary (
+                folder_id, month, transaction_vendor,
+                transaction_count, total_amount
+            )
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (folder_id, month, transaction_vendor) DO UPDATE SET
+                transaction_count =
+                    spend_summary.transaction_count + excluded.transaction_count,
+                total_amount = spend_summary.total_amount + excluded.total_amount
+            """,
+            [
+                (folder_id, month.isoformat(), vendor, count, total)
+                for (folder_id, month, vendor), (count, total) in deltas.items()
+            ],
+        )
+
+    def _rebuild_spend_summary(self, folder_ids=None):
+        folder_ids = list(folder_ids) if folder_ids is not None else None
+        folder_filter = (
+            ""
+            if folder_ids is None
+            else f"WHERE folder_id IN ({self._placeholders(folder_ids)})"
+        )
+        params = folder_ids or []
+        self.conn.execute(f"DELETE FROM spend_summary {folder_filter}", params)
+        self.conn.execute(
+            f"""
+            INSERT INTO spend_summary (
+                folder_id, month, transaction_vendor,
+                transaction_count, total_amount
+            )
+            SELECT folder_id, substr(transaction_date, 1, 7) || '-01',
+                transaction_vendor, COUNT(*), SUM(transaction_amount)
+            FROM messages
+            {folder_filter}
+            GROUP BY 1, 2, 3
+            """,
+            params,
+        )
+
+    def rebuild_spend_summary(self, folder_ids=None):
+        self.conn.execute("BEGIN")
+        try:
+            self._rebuild_spend_summary(folder_ids)
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def get_spend_summary(self, folder_name=None):
+        rows = self.conn.execute(
+            """
+            SELECT f.folder_name, s.month, s.transaction_vendor,
+                s.transaction_count, s.total_amount
+            FROM spend_summary s
+            JOIN folders f ON f.id = s.folder_id
+            WHERE :folder IS NULL OR f.folder_name = :folder
+            ORDER BY s.month DESC, f.folder_name, s.transaction_vendor
+            """,
+            {"folder": folder_name},
+        ).fetchall()
+        return [
+            _summary_row(folder, self._to_date(month), vendor, count, total)
+            for folder, month, vendor, count, total in rows
+        ]
+
+    def refresh_watermarks(self):
+        self.conn.execute(
+            """
+            UPDATE folders
+            SET last_trans_date = (
+                SELECT MAX(transaction_date) FROM messages
+                WHERE messages.folder_id = folders.id
+            )
+            WHERE EXISTS (SELECT 1 FROM messages WHERE messages.folder_id = folders.id)
+            """
+        )
+
+    def record_backfill_shards(self, folder_name, shards):
+        self._run_in_transaction(
+            """
+            INSERT INTO backfill_shards (folder_name, shard_start, shard_end)
+            VALUES (?, ?, ?)
+            ON CONFLICT DO NOTHING
+            """,
+            [
+                (folder_name, start.isoformat(), end.isoformat())
+                for start, end in shards
+            ],
+        )
+
+    def get_completed_backfill_shards(self, folder_name):
+        rows = self.conn.execute(
+            """
+            SELECT shard_start, shard_end FROM backfill_shards
+            WHERE folder_name = ? AND status = 'done'
+            """,
+            (folder_name,),
+        ).fetchall()
+        return {(self._to_date(start), self._to_date(end)) for start, end in rows}
+
+    def mark_backfill_shard(self, folder_name, shard, status, message_count=None):
+        self.conn.execute(
+            """
+            UPDATE backfill_shards
+            SET status = ?, message_count = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE folder_name = ? AND shard_start = ? AND shard_end = ?
+            """,
+            (
+                status,
+                message_count,
+                folder_name,
+                shard[0].isoformat(),
+                shard[1].isoformat(),
+            ),
+        )
+
+    def query_transactions(
+        self,
+        folder_name=None,
+        start_date=None,
+        end_date=None,
+        vendor_prefix=None,
+        min_amount=None,
+        max_amount=None,
+        after=None,
+        limit=100,
+    ):
+        conditions, params = [], []
+        if folder_name is not None:
+            conditions.append("f.folder_name = ?")
+            params.append(folder_name)
+        if start_date is not None:
+            conditions.append("m.transaction_date >= ?")
+            params.append(start_date.isoformat())
+        if end_date is not None:
+            conditions.append("m.transaction_date <= ?")
+            params.append(end_date.isoformat())
+        if vendor_prefix:
+            # GLOB is case-sensitive like Postgres LIKE and can use the index
+            escaped = re.sub(r"([*?[])", r"[\1]", vendor_prefix)
+            conditions.append("m.transaction_vendor GLOB ?")
+            params.append(f"{escaped}*")
+        if min_amount is not None:
+            conditions.append("m.transaction_amount >= ?")
+            params.append(min_amount)
+        if max_amount is not None:
+            conditions.append("m.transaction_amount <= ?")
+            params.append(max_amount)
+        if after is not None:
+            conditions.append("(m.transaction_date, m.id) < (?, ?)")
+            params.extend([after[0].isoformat(), after[1]])
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.conn.execute(
+            f"""
+            SELECT m.id, f.folder_name, m.transaction_date,
+                m.transaction_vendor, m.transaction_amount, m.category
+            FROM messages m
+            JOIN folders f ON f.id = m.folder_id
+            {where}
+            ORDER BY m.transaction_date DESC, m.id DESC
+            LIMIT ?
+            """,
+            params + [limit],
+        ).fetchall()
+        return [
+            _transaction_row(
+                mid, folder, self._to_date(trans_date), vendor, amount, category
+            )
+            for mid, folder, trans_date, vendor, amount, category in rows
+        ]
+
+    def export_messages_csv(self, f):
+        cursor = self.conn.execute("SELECT * FROM messages")
+        writer = csv.writer(f)
+        writer.writerow([column[0] for column in cursor.description])
+        writer.writerows(cursor)
+
+    def query(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+def _summary_row(folder_name, month, vendor, count, total) -> Dict[str, Any]:
+    return {
+        "folder": folder_name,
+        "month": month.isoformat(),
+        "vendor": vendor,
+        "transaction_count": count,
+        "total_amount": round(float(total), 2),
+    }
+
+
+def _transaction_row(
+    mid, folder_name, trans_date, vendor, amount, category
+) -> Dict[str, Any]:
+    return {
+        "id": mid,
+        "folder": folder_name,
+        "transaction_date": trans_date.isoformat(),
+        "transaction_vendor": vendor,
+        "transaction_amount": round(float(amount), 2),
+        "category": category,
+    }
+
+
+def open_storage(db_details: Dict[str, Any]) -> Storage:
+    """
+    Opens the storage backend described by the config's database_details.
+    `"backend": "sqlite"` (with an optional `"path"`) selects the embedded
+    backend; anything else connects to PostgreSQL.
+    """
+    db_details = dict(db_details)
+    backend = db_details.pop("backend", "postgres")
+
+    if backend == "sqlite":
+        return SQLiteStorage(path=db_details.get("path", "autobudget.db"))
+    if backend == "postgres":
+        return PostgresStorage(**db_details)
+
+    raise ValueError(f"Unknown storage backend '{backend}'")
@@ -0,0 +1,193 @@
+from array import array
+from datetime import date
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from utils.storage import FolderInfo, MessageRow
+
+
+class Transaction:
+    """
+    One parsed transaction email. Slotted, so large backfills do not pay for a
+    per-record __dict__.
+    """
+
+    __slots__ = (
+        "id",
+        "folder_name",
+        "content",
+        "transaction_date",
+        "transaction_amount",
+        "transaction_vendor",
+        "category",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        folder_name: str,
+        content: str,
+        transaction_date: Optional[date],
+        transaction_amount: Any,
+        transaction_vendor: Optional[str],
+        category: Optional[str] = None,
+    ):
+        self.id = id
+        self.folder_name = folder_name
+        self.content = content
+        self.transaction_date = transaction_date
+        self.transaction_amount = transaction_amount
+        self.transaction_vendor = transaction_vendor
+        self.category = category
+
+    def __repr__(self):
+        return (
+            f"Transaction(id={self.id!r}, folder_name={self.folder_name!r}, "
+            f"transaction_date={self.transaction_date!r}, "
+            f"transaction_amount={self.transaction_amount!r}, "
+            f"transaction_vendor={self.transaction_vendor!r}, "
+            f"category={self.category!r})"
+        )
+
+
+def _to_amount(value: Any) -> float:
+    # Extraction yields "" or None when an amount marker is missing
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class TransactionBatch:
+    """
+    A columnar batch of transactions, handed between the pipeline stages.
+    Dates are kept as ordinals (0 = missing) and amounts as float64 (NaN =
+    missing) in NumPy arrays, and folders as codes into `folders`, so
+    validation and watermark checks run over whole columns. Text fields stay
+    in plain lists.
+    """
+
+    def __init__(self, transactions: Iterable[Transaction] = ()):
+        self.ids: List[str] = []
+        self.folders: List[str] = []
+        self.contents: List[str] = []
+        self.vendors: List[Optional[str]] = []
+        self.categories: List[Optional[str]] = []
+
+        folder_codes = array("q")
+        dates = array("q")
+        amounts = array("d")
+        folder_index: Dict[str, int] = {}
+
+        for transaction in transactions:
+            code = folder_index.get(transaction.folder_name)
+            if code is None:
+                code = folder_index[transaction.folder_name] = len(self.folders)
+                self.folders.append(transaction.folder_name)
+
+            self.ids.append(transaction.id)
+            folder_codes.append(code)
+            self.contents.append(transaction.content)
+            dates.append(
+                transaction.transaction_date.toordinal()
+                if transaction.transaction_date
+                else 0
+            )
+            amounts.append(_to_amount(transaction.transaction_amount))
+            self.vendors.append(transaction.transaction_vendor)
+            self.categories.append(transaction.category)
+
+        self.folder_codes = np.frombuffer(folder_codes, dtype=np.int64)
+        self.dates = np.frombuffer(dates, dtype=np.int64)
+        self.amounts = np.frombuffer(amounts, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[Transaction]:
+        for i in range(len(self.ids)):
+            ordinal = int(self.dates[i])
+            amount = float(self.amounts[i])
+            yield Transaction(
+                self.ids[i],
+                self.folders[self.folder_codes[i]],
+                self.contents[i],
+                date.fromordinal(ordinal) if ordinal else None,
+                None if np.isnan(amount) else amount,
+                self.vendors[i],
+                self.categories[i],
+            )
+
+    def select(self, mask: np.ndarray) -> "TransactionBatch":
+        """
+        Returns the transactions where the boolean `mask` is set.
+        """
+        indices = np.flatnonzero(mask).tolist()
+        batch = TransactionBatch()
+        batch.ids = [self.ids[i] for i in indices]
+        batch.folders = self.folders
+        batch.contents = [self.contents[i] for i in indices]
+        batch.vendors = [self.vendors[i] for i in indices]
+        batch.categories = [self.categories[i] for i in indices]
+        batch.folder_codes = self.folder_codes[mask]
+        batch.dates = self.dates[mask]
+        batch.amounts = self.amounts[mask]
+        return batch
+
+    def valid(self) -> np.ndarray:
+        """
+        Mask of the transactions with both a date and an amount.
+        """
+        return (self.dates > 0) & ~np.isnan(self.amounts)
+
+    def in_folders(self, folder_info: Dict[str, FolderInfo]) -> np.ndarray:
+        """
+        Mask of the transactions whose folder is in `folder_info`.
+        """
+        known = np.array([name in folder_info for name in self.folders], dtype=bool)
+        return known[self.folder_codes]
+
+    def newer_than_watermarks(self, folder_info: Dict[str, FolderInfo]) -> np.ndarray:
+        """
+        Mask of the transactions dated after their folder's last transaction
+        date. Folders without a watermark (or unknown ones) keep everything.
+        """
+        watermarks = np.array(
+            [
+                folder_info[name][1].toordinal()
+                if name in folder_info and folder_info[name][1]
+                else 0
+                for name in self.folders
+            ],
+            dtype=np.int64,
+        )
+        return self.dates > watermarks[self.folder_codes]
+
+    def rows(self, folder_info: Dict[str, FolderInfo]) -> List[MessageRow]:
+        """
+        Returns the message rows for a bulk insert. Every transaction must be
+        valid and belong to a folder in `folder_info`.
+        """
+        # `folders` may still list folders whose transactions were filtered out
+        folder_ids = [folder_info.get(name, (None, None))[0] for name in self.folders]
+        return [
+            (
+                mid,
+                folder_ids[code],
+                content,
+                date.fromordinal(ordinal),
+                vendor,
+                amount,
+                category,
+            )
+            for mid, code, content, ordinal, vendor, amount, category in zip(
+                self.ids,
+                self.folder_codes.tolist(),
+                self.contents,
+                self.dates.tolist(),
+                self.vendors,
+                self.amounts.tolist(),
+                self.categories,
+            )
+        ]